@@ -1,10 +1,31 @@
 import streamlit as st
 import google.generativeai as genai
-from gtts import gTTS
-import PyPDF2
-import io
+import hashlib
 import json
-import re
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from audio_prep import can_encode_flac, prepare_audio
+from chat_manager import ChatManager
+from doc_index import load_or_build_index
+from doc_store import DocStore
+from drill_pack import DRILL_PACK_DIR, DrillPack, list_packs
+from helper_tools import ToolCache
+from jobs import JobRunner, SessionJobs
+from message_model import clean_text_for_tts, completed_target, parse_response, user_message
+from model_router import DEFAULT_FAST_SITES, SITES, ModelRouter, is_retryable
+from perf import PerfLog, PerfRecorder
+from prompts import (
+    GIVEUP_PROMPT, HINT_TYPES, PRACTICE_DONE_PROMPT, QUESTION_TOOLS, REPEAT_PROMPT, START_PROMPT,
+    build_system_instruction, dictionary_prompt, jp_to_en_prompt,
+)
+from pronunciation import build_judge_prompt, diff_markdown, is_exact_match, parse_judge_result, word_diff
+from response_cache import ResponseCache
+from session_store import ConversationLog, SessionStore
+from tts_cache import TTSCache
 
 # === 🎨 画面デザインのカスタマイズ（CSS） ===
 st.markdown("""
@@ -47,13 +68,105 @@ except Exception:
     st.stop()
 genai.configure(api_key=MY_API_KEY.strip())
 
-# === 🧹 音声読み上げ用テキストクリーナー ===
-def clean_text_for_tts(text):
-    # Markdownの記号(*, _, #, ~)を完全に削除
-    text = re.sub(r'[*_#~]', '', text)
-    # 単語を囲むアポストロフィや引用符だけを削除（It's のような単語内のアポストロフィは残す）
-    text = re.sub(r"(?<!\w)['\"]|['\"](?!\w)", '', text)
-    return text.strip()
+# === 🗄️ キャッシュの保存先（サーバー全体で共有） ===
+CACHE_DIR = ".app_cache"
+
+@st.cache_resource
+def get_tts_cache():
+    return TTSCache(os.path.join(CACHE_DIR, "tts"))
+
+tts_cache = get_tts_cache()
+
+@st.cache_resource
+def get_doc_store():
+    return DocStore(os.path.join(CACHE_DIR, "docs"))
+
+doc_store = get_doc_store()
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(os.path.join(CACHE_DIR, "responses.sqlite3"))
+
+response_cache = get_response_cache()
+
+@st.cache_resource
+def get_session_store():
+    return SessionStore(os.path.join(CACHE_DIR, "sessions.sqlite3"))
+
+session_store = get_session_store()
+
+@st.cache_resource
+def get_prefetch_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+@st.cache_resource
+def get_model_router():
+    return ModelRouter()
+
+router = get_model_router()
+
+@st.cache_resource
+def get_job_runner():
+    return JobRunner()
+
+@st.cache_resource
+def get_perf_log():
+    return PerfLog(os.path.join(CACHE_DIR, "perf.jsonl"))
+
+# === ⏱️ このセッションの処理時間の記録 ===
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
+if "perf" not in st.session_state:
+    st.session_state.perf = PerfRecorder(st.session_state.session_id, get_perf_log())
+perf = st.session_state.perf
+
+# === ⏳ このセッションのバックグラウンド・ジョブ ===
+if "jobs" not in st.session_state:
+    st.session_state.jobs = SessionJobs(get_job_runner())
+jobs = st.session_state.jobs
+JOB_POLL_SECONDS = 1.0
+# 評価のジョブは ChatManager の履歴を別スレッドで書き換えるので、その間は会話を進めるボタンを止める
+evaluating = any(job.slot == "evaluation" for job in jobs.pending())
+
+# === 💾 会話の再開（URLの ?sid=会話ID から、保存しておいた会話を読み込む） ===
+if "conversation_id" not in st.session_state:
+    resume_id = st.query_params.get("sid", "")
+    resume_snapshot = session_store.load(resume_id) if resume_id else None
+    st.session_state.conversation_id = resume_id if resume_snapshot else ""
+    # 設定欄の初期値として使い続ける（途中で変えると入力欄がリセットされるため）
+    st.session_state.resumed_settings = resume_snapshot["settings"] if resume_snapshot else {}
+    if resume_snapshot:
+        st.session_state.resume_snapshot = resume_snapshot
+        st.session_state.messages = ConversationLog(session_store, resume_id)
+        st.session_state.stats_turns = resume_snapshot["stats"].get("turns", 0)
+        st.session_state.stats_mistakes = resume_snapshot["stats"].get("mistakes", 0)
+
+@st.cache_resource(max_entries=4)
+def get_drill_pack(path, mtime):
+    # 読み込んだ時に音声を読み上げキャッシュへ入れておく（以後の再生はキャッシュから）
+    pack = DrillPack.load(path)
+    pack.seed_tts(tts_cache)
+    return pack
+
+@st.cache_resource(max_entries=8)
+def get_doc_index(doc_hash):
+    return load_or_build_index(doc_hash, lambda: doc_store.text(doc_hash), os.path.join(CACHE_DIR, "doc_index"))
+
+# === 📨 メッセージの記録（AIの返答は届いた時に1回だけ解析する） ===
+def last_question():
+    return st.session_state.messages.last_question() if "messages" in st.session_state else ""
+
+def last_reply():
+    """直前のAIの返答（最後のメッセージがAIの返答でなければ空文字）。"""
+    messages = st.session_state.get("messages")
+    if not messages or messages[-1].role != "assistant":
+        return ""
+    return messages[-1].content
+
+def append_response(text):
+    message = parse_response(text, previous_question=last_question())
+    st.session_state.messages.append(message)
+    return message
 
 st.title("My English Roleplay AI 🗣️")
 
@@ -63,11 +176,25 @@ with st.sidebar:
     
     model_options = {"賢い・やや遅い": "gemini-2.5-flash", "最速・低コスト": "gemini-2.5-flash-lite"}
     selected_model = model_options[st.selectbox("使用中の脳みそ", list(model_options.keys()), index=0)]
+    with st.expander("🧭 処理ごとのモデルの使い分け"):
+        fast_sites = st.multiselect("最速モデル（flash-lite）で行う処理", list(SITES), default=DEFAULT_FAST_SITES, format_func=lambda site: SITES[site][0])
+        st.caption("それ以外は上で選んだモデルを使います。混雑や遅延を検知すると、しばらく自動で最速モデルに切り替えます。")
+        router_stats = router.stats()
+        st.caption(f"自動切り替え {router_stats['fallbacks']} 回 / 二重送信 {router_stats['hedged']} 回（最速モデルが先着 {router_stats['hedge_wins']} 回）")
+        if router_stats["degraded"]:
+            st.caption(f"⚠️ 一時的に避けているモデル: {', '.join(router_stats['degraded'])}")
+    stream_replies = st.toggle("⚡ 返答を届いた順に表示する（ストリーミング）", value=True)
+    prefetch_tools = st.toggle("🚀 お助けツールを先読みする（API呼び出しが増えます）", value=False)
+    with st.expander("🎧 録音の送り方"):
+        trim_audio = st.toggle("前後の無音を切り落とす", value=True)
+        flac_audio = st.toggle("FLACに圧縮して送る", value=can_encode_flac(), disabled=not can_encode_flac(),
+                               help="soundfile（pip install soundfile）が入っている時だけ使えます。無い時は16kHzモノラルのWAVで送ります")
+    history_token_budget = st.number_input("🧠 AIに渡す会話履歴の上限（トークン）", min_value=500, max_value=16000, value=2000, step=250, help="超えた分は古い順に要約にまとめます")
     
     st.markdown("---")
     st.write("📂 **設定の読み込み**")
     setting_file = st.file_uploader("保存した設定（.json）をアップロード", type=["json"])
-    loaded_settings = json.load(setting_file) if setting_file else {}
+    loaded_settings = json.load(setting_file) if setting_file else st.session_state.resumed_settings
 
     def_level = loaded_settings.get("level", "2: 初心者（日常会話の基礎）")
     level_list = [
@@ -84,23 +211,54 @@ with st.sidebar:
     questioner = st.text_input("👤 相手の役柄（詳細に）", value=loaded_settings.get("questioner", "同年代の気さくな友達"), placeholder="例: 空港の入国審査官。少し厳しめ。")
     situation = st.text_area("🎬 シチュエーション", value=loaded_settings.get("situation", "週末の予定について話しています。"), height=80)
     focus_words = st.text_input("🎯 練習したい単語・テーマ (任意)", value=loaded_settings.get("focus_words", ""), placeholder="例: 医療系頻出単語")
+    tts_slow = st.checkbox("🐢 英語をゆっくり読み上げる", value=loaded_settings.get("tts_slow", False))
     
-    doc_text = loaded_settings.get("doc_text", "")
+    # 資料の本文は設定ファイルには入れず、ファイルのハッシュだけを保存する（本文はサーバーのキャッシュに置く）
+    doc_hash = loaded_settings.get("doc_hash", "")
+    if not doc_hash and loaded_settings.get("doc_text", "").strip():
+        doc_hash = doc_store.add_text(loaded_settings["doc_text"])  # 以前の形式（本文入り）の設定ファイル
     uploaded_file = st.file_uploader("新しい資料 (PDF/TXT)", type=["pdf", "txt"])
+    parallel_pdf = st.checkbox("⚡ ページ数の多いPDFは並列で読み込む", value=True)
     if uploaded_file:
         if uploaded_file.name.endswith('.pdf'):
-            reader = PyPDF2.PdfReader(uploaded_file)
-            doc_text = "".join([page.extract_text() + "\n" for page in reader.pages])
+            with st.spinner("資料を読み込み中..."):
+                doc_hash = doc_store.add_pdf(uploaded_file.getvalue(), parallel=parallel_pdf)
         else:
-            doc_text = uploaded_file.read().decode('utf-8')
-        st.success("資料を読み込みました！")
+            doc_hash = doc_store.add_text(uploaded_file.getvalue().decode('utf-8'))
+        st.success(f"資料を読み込みました！（{doc_store.page_count(doc_hash)}ページ）")
+    doc_token_budget = st.number_input("📄 1ターンで資料から渡す量（トークン上限）", min_value=200, max_value=8000, value=loaded_settings.get("doc_token_budget", 1500), step=100)
+    doc_index = get_doc_index(doc_hash) if doc_hash else None
+    if doc_hash and doc_index is None:
+        get_doc_index.clear()
+        st.warning("設定ファイルの資料がこのサーバーに見つかりません。資料をもう一度アップロードしてください。")
 
     st.markdown("---")
-    current_settings = {"level": level, "user_name": user_name, "questioner": questioner, "situation": situation, "focus_words": focus_words, "doc_text": doc_text}
-    st.download_button("💾 現在の設定を保存（.json）", data=json.dumps(current_settings, ensure_ascii=False, indent=2), file_name="english_settings.json", mime="application/json", use_container_width=True)
+    current_settings = {"level": level, "user_name": user_name, "questioner": questioner, "situation": situation, "focus_words": focus_words, "tts_slow": tts_slow, "doc_token_budget": doc_token_budget, "doc_hash": doc_hash}
+    # ダウンロードの中身は、ボタンが押された時にだけ作る
+    st.download_button("💾 現在の設定を保存（.json）", data=partial(json.dumps, current_settings, ensure_ascii=False, indent=2), file_name="english_settings.json", mime="application/json", use_container_width=True)
+
+    # 🧩 ドリルパック（drill_pack.py で事前に作った問題集）。設定が一致する時だけ、決まったやり取りをパックから返す
+    drill = None
+    pack_files = list_packs()
+    if pack_files:
+        pack_name = st.selectbox("🧩 ドリルパック", ["使わない"] + pack_files)
+        if pack_name != "使わない":
+            pack_path = os.path.join(DRILL_PACK_DIR, pack_name)
+            try:
+                drill = get_drill_pack(pack_path, os.path.getmtime(pack_path))
+            except Exception:
+                st.warning("ドリルパックを読み込めませんでした。")
+            if drill is not None:
+                if drill.matches(current_settings, has_doc=bool(doc_index)):
+                    st.caption(f"✅ {drill.describe()}")
+                else:
+                    st.caption("⚠️ 今の設定（レベル・名前・役柄・状況・テーマ）がパックと違うか、資料が読み込まれているため使いません。パックを作った設定ファイルを読み込んでください。")
+                    drill = None
 
     start_button = st.button("▶️ 会話をリセットしてスタート", type="primary", use_container_width=True)
-    end_button = st.button("🛑 会話を終了して評価をもらう", use_container_width=True)
+    end_button = st.button("🛑 会話を終了して評価をもらう", use_container_width=True, disabled=evaluating)
+    if st.session_state.conversation_id:
+        st.caption(f"🔖 会話ID: {st.session_state.conversation_id}（このページのURLを開き直せば、続きから再開できます）")
 
     # 📊 進捗ダッシュボード（簡易）
     st.markdown("---")
@@ -110,130 +268,270 @@ with st.sidebar:
         st.session_state.stats_mistakes = 0
     st.write(f"- 発話ターン数: {st.session_state.stats_turns} 回")
     st.write(f"- リピート練習: {st.session_state.stats_mistakes} 回")
+    tts_stats = tts_cache.stats()
+    resp_stats = response_cache.stats()
+    st.caption(f"🗃️ 辞書・翻訳キャッシュ: ヒット率 {resp_stats['hit_rate']:.0%}（{resp_stats['hits']}/{resp_stats['hits'] + resp_stats['misses']} 回、保存 {resp_stats['entries']} 件）")
+    st.caption(f"🔊 音声キャッシュ: ヒット {tts_stats['memory_hits'] + tts_stats['disk_hits']} 回 / ミス {tts_stats['misses']} 回（新規生成 {tts_stats['synthesized']} 回）")
+    with st.expander("⏱️ パフォーマンス（処理時間の記録）"):
+        perf_rows = perf.summary()
+        if perf_rows:
+            st.dataframe(perf_rows, hide_index=True, use_container_width=True)
+            st.caption("p50＝ふだんの待ち時間、p95＝遅い時の待ち時間。キャッシュから返した分も含みます。")
+        else:
+            st.caption("まだ記録がありません。")
 
     # ★復活：今日の会話記録を保存
     st.markdown("---")
     if "messages" in st.session_state and len(st.session_state.messages) > 0:
-        log_text = "【今日の英会話記録】\n\n"
-        for msg in st.session_state.messages:
-            if msg["role"] == "user" and msg["content"].startswith("（"):
-                continue
-            sender = "あなた" if msg["role"] == "user" else "AI"
-            content = msg["content"].replace("[フィードバック]", "\n[フィードバック]").replace("[英語の質問]", "\n[英語の質問]").replace("[リピート練習]", "\n[リピート練習]")
-            log_text += f"{sender}:\n{content.strip()}\n\n{'='*40}\n\n"
-            
-        st.download_button("📝 今日の会話記録を保存（.txt）", data=log_text, file_name="english_log.txt", mime="text/plain", use_container_width=True)
+        st.download_button("📝 今日の会話記録を保存（.txt）", data=partial(session_store.export_log, st.session_state.conversation_id), file_name="english_log.txt", mime="text/plain", use_container_width=True)
 
 # === 🤖 AIへの絶対的な指示書 ===
-system_instruction = f"""
-あなたは英会話のロールプレイング相手です。
-【相手の役柄】: {questioner}
-【ユーザーの名前】: {user_name}
-【レベル】: {level}
-【状況】: {situation}
-【重点テーマ】: {focus_words}
-【資料】: {doc_text}
-
-【絶対に守るべき厳格なルール】
-1. あなたの出力は、以下の「指定フォーマット」のブロックのみで構成してください。
-2. 「はい、承知しました」などの会話のシステム的な前置きは絶対に出力しないでください。
-3. 英文中で単語を強調する際は、アポストロフィ（' '）やダブルクォーテーション（" "）を使わず、必ずMarkdownの太字（**単語**）を使用してください。
-4. 【重要】指定フォーマット内の括弧（ ）は説明書きです。出力する際は括弧そのものを削除し、中身のテキストだけを出力してください。
-
-【指定フォーマット】※以下のA・B・Cのいずれかのパターンのみを出力すること。
-
-▼ パターンA：ユーザーの英語にミス・不自然さがある場合（リピート練習）
-[フィードバック]
-- （日本語でのミスの指摘と解説）
-- 和訳: （すぐ下の[リピート練習]の英文の日本語訳）
-[リピート練習]
-（ユーザーが復唱するための、正しい英語のセリフのみ。記号は使わない）
-
-▼ パターンB：ユーザーの英語が自然、または会話の開始時（通常進行）
-[フィードバック]
-- （日本語で短く褒める、または相槌）
-[英語の質問]
-（役柄としてユーザーに投げかける英語のセリフや質問文のみ）
-
-▼ パターンC：ユーザーから「今の質問をもう一度言って」と頼まれた場合（やり直し）
-[フィードバック]
-- （日本語で「もう一度言いますね」と短く返事）
-[英語の質問]
-（直前と全く同じ英語の質問文）
-"""
+system_instruction = build_system_instruction(questioner, user_name, level, situation, focus_words, has_doc=bool(doc_index))
+
+# === 📡 AIへの送信（ストリーミング時は届いた分から表示し、英文が揃い次第音声を作り始める） ===
+def doc_context(prompt):
+    # 資料は全文ではなく、今の質問・発言・重点テーマに関係する部分だけを毎ターン添える
+    if not doc_index:
+        return ""
+    query = " ".join([last_question() or situation, prompt, focus_words])
+    excerpts = doc_index.select(query, doc_token_budget)
+    if not excerpts:
+        return ""
+    joined = "\n---\n".join(excerpts)
+    return f"【参考資料（抜粋）】\n{joined}"
+
+def ask_model(prompt, kind, main_model=selected_model, fast_sites=tuple(fast_sites), generation_config=None, upload_bytes=0):
+    # バックグラウンドのスレッドからも呼ばれるので、st.* は使わないこと
+    def attempt(model_name, timeout):
+        with perf.track(kind, model_name, upload_bytes=upload_bytes) as event:
+            response = genai.GenerativeModel(model_name, generation_config=generation_config).generate_content(prompt, request_options={"timeout": timeout})
+            event.set_usage(response)
+        return response
+    return router.call(kind, main_model, attempt, fast_sites)
+
+def ask_model_cached(prompt, kind, main_model=selected_model, fast_sites=tuple(fast_sites)):
+    # 入力だけで答えが決まるお助けツール用。家族の誰かが同じことを聞いていれば、APIを呼ばずに返す
+    model_name = router.model_for(kind, main_model, fast_sites)
+    start = time.perf_counter()
+    text = response_cache.get(model_name, prompt)
+    if text is not None:
+        perf.record(kind, time.perf_counter() - start, model=model_name, cache_hit=True)
+        return text
+    text = ask_model(prompt, kind, main_model, fast_sites).text
+    response_cache.put(model_name, prompt, text)
+    return text
+
+def ask_tool(tool, prompt):
+    # "hint:文の出だし（3語）" のようなツール名は、記録上は "hint" にまとめる
+    return ask_model_cached(prompt, kind=tool.split(":")[0])
+
+def audio_key(audio_bytes):
+    return hashlib.sha256(audio_bytes).hexdigest()[:16]
+
+def prepare_recording(audio_bytes):
+    # 送る前に手元で無音カット・16kHzモノラル化・圧縮をして、どれだけ小さくなったかを記録する
+    start = time.perf_counter()
+    audio = prepare_audio(audio_bytes, trim=trim_audio, flac=flac_audio)
+    perf.record("audio_prep", time.perf_counter() - start, upload_bytes=len(audio.data), original_bytes=audio.original_bytes)
+    return audio
+
+# 以下の2つはジョブとしてバックグラウンドで動くので、st.* は使わないこと
+def transcribe(audio_bytes):
+    audio = prepare_recording(audio_bytes)
+    res = ask_model([{"mime_type": audio.mime_type, "data": audio.data}, "英語を文字起こししてください。文字のみ出力。"], "transcribe",
+                    upload_bytes=len(audio.data))
+    return audio, res.text.strip() if res.parts else ""
+
+def judge_pronunciation(audio_bytes, target):
+    # 文字起こしと判定を1回のリクエストでまとめて行う
+    audio = prepare_recording(audio_bytes)
+    judge_res = ask_model([{"mime_type": audio.mime_type, "data": audio.data}, build_judge_prompt(target)], "judge",
+                          generation_config={"response_mime_type": "application/json"}, upload_bytes=len(audio.data))
+    result = parse_judge_result(judge_res.text if judge_res.parts else "")
+    if not result.transcript:
+        raise ValueError("empty transcript")
+    return audio, result
+
+def send_chat_blocking(manager, prompt, context, kind, hedge=False):
+    contents = manager.prepare(prompt, context)
+    call = router.call_hedged if hedge else router.call
+    reply = call(kind, selected_model, lambda model_name, timeout: manager.generate(contents, kind, model_name, timeout), fast_sites)
+    manager.commit(prompt, reply)
+    return reply
+
+def send_chat(prompt, kind="chat"):
+    manager = st.session_state.chat_manager
+    # ドリルパックに用意してある流れなら、AIを呼ばずにそのまま使う
+    scripted = drill.scripted_reply(prompt, last_question(), last_reply()) if drill else None
+    if scripted is not None:
+        manager.commit(prompt, scripted)
+        perf.record(kind, 0.0, model="drill_pack", cache_hit=True)
+        return scripted
+    context = doc_context(prompt)
+    # 最近の返答が遅い（p95が閾値超え）時は、ストリーミングをやめて最速モデルとの二重送信で待ち時間を抑える
+    hedge = router.should_hedge(perf.latency_percentile(kind, 95))
+    if hedge or not stream_replies:
+        return send_chat_blocking(manager, prompt, context, kind, hedge)
+    
+    text = ""
+    spoken = ""     # ストリーミング中に読み上げを作り始めた英文
+    model_name = router.model_for(kind, selected_model, fast_sites)
+    start = time.perf_counter()
+    # 表示は途中経過用。完成した返答はこの後の通常の描画に任せるので、最後に消す
+    bubble = st.empty()
+    try:
+        with bubble.container(), st.chat_message("assistant"):
+            placeholder = st.empty()
+            for piece in manager.stream(prompt, context, kind=kind, model_name=model_name, timeout=router.timeout_seconds):
+                text += piece
+                placeholder.markdown(text + " ▌")
+                if not spoken:
+                    target = completed_target(text)
+                    if target:
+                        spoken = clean_text_for_tts(target)
+                        tts_cache.prefetch(spoken, lang='en', slow=tts_slow, recorder=perf)
+    except Exception as e:
+        # 1文字も届かないうちの混雑・タイムアウトなら、最速モデルでやり直す
+        if text or not is_retryable(e) or model_name == router.fast_model:
+            raise
+        router.report_failure(model_name)
+        bubble.empty()
+        return send_chat_blocking(manager, prompt, context, kind)
+    router.report_latency(kind, model_name, time.perf_counter() - start)
+    bubble.empty()
+    
+    # 英文が複数行で、途中までしか読み上げを作れていなかった時は、全文でもう一度作る（描画の時に待たせないように）
+    reply = parse_response(text)
+    if reply.speak_text and reply.speak_text != spoken:
+        tts_cache.prefetch(reply.speak_text, lang='en', slow=tts_slow, recorder=perf)
+    return text
 
 if "last_played_msg_idx" not in st.session_state:
     st.session_state.last_played_msg_idx = -1
 if "tool_cache" not in st.session_state:
-    st.session_state.tool_cache = {}
+    st.session_state.tool_cache = ToolCache()
+
+# 再読み込み・再起動の後は、保存しておいた要約と履歴からAIとの会話を組み立て直す
+resume_snapshot = st.session_state.pop("resume_snapshot", None)
+if resume_snapshot and "chat_manager" not in st.session_state:
+    st.session_state.chat_manager = ChatManager(selected_model, system_instruction, history_token_budget=history_token_budget,
+                                                summary_model_name=router.model_for("history_summary", selected_model, fast_sites))
+    st.session_state.chat_manager.recorder = perf
+    st.session_state.chat_manager.restore(resume_snapshot["manager"])
 
 if start_button:
     try:
-        model = genai.GenerativeModel(selected_model, system_instruction=system_instruction)
-        st.session_state.chat_session = model.start_chat(history=[])
-        st.session_state.messages = []
+        if "chat_manager" in st.session_state:
+            # 前の会話のコンテキストキャッシュは、期限を待たずに消す
+            st.session_state.chat_manager.close()
+        st.session_state.chat_manager = ChatManager(selected_model, system_instruction, history_token_budget=history_token_budget,
+                                                    summary_model_name=router.model_for("history_summary", selected_model, fast_sites))
+        st.session_state.chat_manager.recorder = perf
+        # 新しい会話には新しいIDをつける（前の会話はそのIDでいつでも再開できる）
+        st.session_state.conversation_id = uuid.uuid4().hex[:12]
+        st.query_params["sid"] = st.session_state.conversation_id
+        session_store.create(st.session_state.conversation_id, current_settings)
+        st.session_state.messages = ConversationLog(session_store, st.session_state.conversation_id)
         st.session_state.last_played_msg_idx = -1
         st.session_state.stats_turns = 0
         st.session_state.stats_mistakes = 0
-        st.session_state.tool_cache = {}
+        st.session_state.tool_cache = ToolCache()
+        st.session_state.pop("last_answer_audio", None)
+        # 前の会話のために動いていたジョブは、結果が届いても使わない
+        jobs.cancel_all()
         
-        response = st.session_state.chat_session.send_message("シチュエーションを開始して、最初の質問を英語でしてください。")
-        st.session_state.messages.append({"role": "assistant", "content": response.text})
+        append_response(send_chat(START_PROMPT, kind="start"))
     except Exception as e:
         st.error(f"準備中にエラーが発生しました: {e}")
 
+# サイドバーでモデルや設定が変わっていれば、会話の履歴はそのままでモデルだけ作り直す
+if "chat_manager" in st.session_state:
+    st.session_state.chat_manager.configure(selected_model, system_instruction)
+    st.session_state.chat_manager.history_token_budget = history_token_budget
+    st.session_state.chat_manager.recorder = perf
+    st.session_state.chat_manager.summary_model_name = router.model_for("history_summary", selected_model, fast_sites)
+
+# 実行中のジョブがある間だけ、画面のこの部分を定期的に描き直して様子を見る。終わったら画面全体を描き直して結果を出す
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_progress():
+    session_jobs = st.session_state.jobs
+    if session_jobs.newly_finished():
+        st.rerun()
+    for job in session_jobs.pending():
+        st.caption(f"⏳ {job.label}中…（{job.elapsed:.0f}秒）")
+
+# この後の描画で結果はすべて出すので、ここまでに終わったジョブは「伝え済み」にしておく
+jobs.newly_finished()
+
+evaluation = jobs.take("evaluation")
+if evaluation and "chat_manager" in st.session_state:
+    if evaluation.error:
+        st.error("評価の作成に失敗しました。もう一度ボタンを押してください。")
+    else:
+        st.session_state.messages.append(user_message("（終了して評価をリクエスト）"))
+        append_response(evaluation.result)
+
+# 学習記録・設定・AIに渡す履歴が変わっていたら、会話のスナップショットを保存し直す
+if "chat_manager" in st.session_state and st.session_state.conversation_id:
+    snapshot = {
+        "settings": current_settings,
+        "stats": {"turns": st.session_state.stats_turns, "mistakes": st.session_state.stats_mistakes},
+        "manager": st.session_state.chat_manager.state(),
+    }
+    snapshot_json = st.session_state.conversation_id + json.dumps(snapshot, ensure_ascii=False, sort_keys=True)
+    if st.session_state.get("saved_snapshot") != snapshot_json:
+        session_store.save_snapshot(st.session_state.conversation_id, **snapshot)
+        st.session_state.saved_snapshot = snapshot_json
+
 # === 会話の描画と音声再生 ===
-if "chat_session" in st.session_state:
-    for i, message in enumerate(st.session_state.messages):
-        if message["role"] == "user" and message["content"].startswith("（"):
-            continue 
-            
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+# 直近のメッセージだけを毎回描画し、それより前はページ単位で必要な時だけ描画する
+RECENT_MESSAGES = 6
+HISTORY_PAGE_SIZE = 10
+
+def render_message(i, message, with_audio):
+    with st.chat_message(message.role):
+        st.markdown(message.content)
+        if not with_audio or not message.speak_text:
+            return
+        try:
+            # 音声を新しく作るのは最新のメッセージだけ。過去の分はキャッシュにある時だけ表示する
+            is_newest = i == len(st.session_state.messages) - 1
+            audio_bytes = tts_cache.get_or_synthesize(message.speak_text, lang='en', slow=tts_slow, allow_synthesis=is_newest, recorder=perf)
             
-            if message["role"] == "assistant":
-                raw_text = ""
-                if "[英語の質問]" in message["content"]:
-                    raw_text = message["content"].split("[英語の質問]")[1].strip()
-                elif "[リピート練習]" in message["content"]:
-                    raw_text = message["content"].split("[リピート練習]")[1].strip()
+            if audio_bytes:
+                auto_play = False
+                if is_newest and st.session_state.last_played_msg_idx != i:
+                    auto_play = True
+                    st.session_state.last_played_msg_idx = i
                     
-                if raw_text:
-                    try:
-                        speak_text = clean_text_for_tts(raw_text)
-                        tts = gTTS(text=speak_text, lang='en')
-                        fp = io.BytesIO()
-                        tts.write_to_fp(fp)
-                        fp.seek(0)
-                        
-                        auto_play = False
-                        if i == len(st.session_state.messages) - 1 and st.session_state.last_played_msg_idx != i:
-                            auto_play = True
-                            st.session_state.last_played_msg_idx = i
-                            
-                        st.audio(fp, format="audio/mp3", autoplay=auto_play)
-                    except Exception:
-                        pass
+                st.audio(audio_bytes, format="audio/mp3", autoplay=auto_play)
+        except Exception:
+            pass
 
-    st.markdown("---")
+if "chat_manager" in st.session_state:
+    # 直近の分はメモリから、それより前はページを開いた時だけディスクから読む
+    recent = st.session_state.messages.recent_visible(RECENT_MESSAGES)
+    older_count = st.session_state.messages.visible_count(recent[0][0]) if recent else 0
     
-    # === 通信量節約機能（スマート・トリミング） ===
-    def get_trimmed_history():
-        raw_history = st.session_state.messages[-8:] if len(st.session_state.messages) > 8 else st.session_state.messages
-        formatted = []
-        for m in raw_history:
-            formatted.append({"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]})
-        return formatted
+    if older_count:
+        if st.toggle(f"📜 それより前の会話を表示（{older_count}件）"):
+            page_count = (older_count + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+            page = st.number_input("ページ（1が最初）", min_value=1, max_value=page_count, value=page_count, step=1) if page_count > 1 else 1
+            for i, message in st.session_state.messages.visible_page(recent[0][0], (page - 1) * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE):
+                render_message(i, message, with_audio=False)
+            st.markdown("---")
+    
+    for i, message in recent:
+        render_message(i, message, with_audio=True)
 
+    st.markdown("---")
+    
     prompt = None
     display_prompt = None
     last_msg = st.session_state.messages[-1] if len(st.session_state.messages) > 0 else None
     
-    is_practice = False
-    target_practice_text = ""
-    if last_msg and last_msg["role"] == "assistant" and "[リピート練習]" in last_msg["content"]:
-        is_practice = True
-        target_practice_text = last_msg["content"].split("[リピート練習]")[1].strip()
+    is_practice = bool(last_msg and last_msg.is_practice)
+    target_practice_text = last_msg.target if is_practice else ""
 
     # ＝＝＝ 🔄 リピート練習モード ＝＝＝
     if is_practice:
@@ -241,33 +539,41 @@ if "chat_session" in st.session_state:
         practice_audio = st.audio_input("発音を録音する")
         
         if practice_audio:
+            practice_bytes = practice_audio.getvalue()
+            judge_key = f"{audio_key(practice_bytes)}:{target_practice_text}"
             if st.button("🤖 AIに発音を判定してもらう", use_container_width=True):
-                with st.spinner("AIが発音を判定中..."):
-                    try:
-                        transcriber = genai.GenerativeModel(selected_model)
-                        res = transcriber.generate_content([{"mime_type": "audio/wav", "data": practice_audio.getvalue()}, "英語を文字起こししてください。文字のみ出力。"])
-                        user_spoken = res.text.strip() if res.parts else ""
-                        st.write(f"🎤 あなたの発音: **{user_spoken}**")
-                        
-                        judge_model = genai.GenerativeModel(selected_model)
-                        judge_res = judge_model.generate_content(f"お手本:「{target_practice_text}」\n発音:「{user_spoken}」\n一言一句同じか厳格に判定し、違いがあれば日本語で1文で指摘してください。")
-                        st.success(f"🤖 判定: {judge_res.text.strip()}")
-                    except Exception:
-                        st.error("聞き取れませんでした。もう一度お願いします。")
+                jobs.submit("judge", judge_key, partial(judge_pronunciation, practice_bytes, target_practice_text), label="発音を判定")
+            judge_job = jobs.get("judge", judge_key)
+            if judge_job and judge_job.done():
+                if judge_job.error:
+                    st.error("聞き取れませんでした。もう一度お願いします。")
+                else:
+                    audio, result = judge_job.result
+                    st.caption(audio.describe())
+                    st.write(f"🎤 あなたの発音: **{result.transcript}**")
+                    
+                    # 一言一句同じかどうかは手元で確かめる（AIの判定より優先）
+                    if is_exact_match(result.transcript, target_practice_text):
+                        st.success("🤖 判定: 完璧です！お手本と一言一句同じでした🎉")
+                    else:
+                        st.markdown(f"📝 お手本との違い: {diff_markdown(word_diff(result.transcript, target_practice_text))}")
+                        st.caption("赤＝言えていない単語 / オレンジの取り消し線＝お手本に無い単語")
+                        if result.match:
+                            st.success("🤖 判定: OKです！（表記の細かな違いだけでした）")
+                        else:
+                            st.warning(f"🤖 判定: {result.correction or 'お手本と少し違うところがあります。もう一度挑戦してみましょう！'}")
         
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("▶️ 練習完了！次へ進む", type="primary", use_container_width=True):
-                prompt = "（リピート練習完了。会話を続けるための新しい質問を【パターンB】の形式でしてください。）"
+            if st.button("▶️ 練習完了！次へ進む", type="primary", use_container_width=True, disabled=evaluating):
+                prompt = PRACTICE_DONE_PROMPT
                 display_prompt = "（✅ 練習を完了し、次へ進みました）"
         with col2:
-            if st.button("↩️ 練習せず1つ前の質問に答え直す (Undo)", use_container_width=True):
+            if st.button("↩️ 練習せず1つ前の質問に答え直す (Undo)", use_container_width=True, disabled=evaluating):
                 if len(st.session_state.messages) >= 3:
-                    st.session_state.messages = st.session_state.messages[:-2]
+                    st.session_state.messages.drop_last(2)
                     st.session_state.stats_mistakes -= 1
-                    
-                    re_model = genai.GenerativeModel(selected_model, system_instruction=system_instruction)
-                    st.session_state.chat_session = re_model.start_chat(history=get_trimmed_history())
+                    st.session_state.chat_manager.rewind()
                     st.session_state.last_played_msg_idx = -1
                     st.rerun()
                 else:
@@ -276,59 +582,78 @@ if "chat_session" in st.session_state:
     # ＝＝＝ 🗣️ 通常モード ＝＝＝
     else:
         st.write("🗣️ **あなたのターン**")
+        if evaluating:
+            st.info("📝 成績をまとめています。終わるまで会話は進められません（お助けツールは使えます）。")
         
-        if st.button("🔄 今の質問をもう一度聞く（別の言い方で答え直したい時など）"):
-            prompt = "すみません、あなたの今の質問にもう一度別の言い方で答えたいので、全く同じ質問文をもう一度言ってください。新しい質問はしないでください。"
+        if st.button("🔄 今の質問をもう一度聞く（別の言い方で答え直したい時など）", disabled=evaluating):
+            prompt = REPEAT_PROMPT
             display_prompt = "（🔄 今の質問をもう一度繰り返してください）"
 
         audio_value = st.audio_input("マイクを押して回答を録音")
+        if st.session_state.get("last_answer_audio"):
+            st.caption(f"前回の録音: {st.session_state.last_answer_audio}")
         if audio_value:
-            if st.button("📤 この音声を文字起こしして送信する", type="primary", use_container_width=True):
-                with st.spinner("文字に変換中..."):
-                    try:
-                        transcriber = genai.GenerativeModel(selected_model)
-                        res = transcriber.generate_content([{"mime_type": "audio/wav", "data": audio_value.getvalue()}, "英語を文字起こししてください。文字のみ出力。"])
-                        if res.parts:
-                            prompt = res.text.strip()
-                            display_prompt = prompt
-                            st.session_state.stats_turns += 1
-                    except Exception:
-                        st.error("聞き取れませんでした。")
+            if st.button("📤 この音声を文字起こしして送信する", type="primary", use_container_width=True, disabled=evaluating):
+                answer_bytes = audio_value.getvalue()
+                jobs.submit("transcribe", audio_key(answer_bytes), partial(transcribe, answer_bytes), label="文字に変換")
+        # 評価中に文字起こしが終わっても、送るのは評価の後（結果は枠に残しておく）
+        transcribed = jobs.take("transcribe") if not evaluating else None
+        if transcribed:
+            answer_audio, answer_text = (None, "") if transcribed.error else transcribed.result
+            if answer_audio:
+                st.session_state.last_answer_audio = answer_audio.describe()
+            if not answer_text:
+                st.error("聞き取れませんでした。")
+            else:
+                prompt = answer_text
+                display_prompt = prompt
+                st.session_state.stats_turns += 1
 
         st.markdown("---")
         
         with st.container(border=True):
             st.write("🛠️ **お助けツール（※会話は進みません）**")
-            current_q = last_msg["content"].split("[英語の質問]")[1].strip() if last_msg and "[英語の質問]" in last_msg["content"] else ""
+            current_q = last_msg.target if last_msg and last_msg.is_question else ""
+            tool_cache = st.session_state.tool_cache
+            if drill and current_q:
+                for tool, text in drill.tool_results(current_q).items():
+                    if tool_cache.get(current_q, tool, wait=False) is None:
+                        tool_cache.put(current_q, tool, text)
+            if current_q and prefetch_tools:
+                tool_cache.prefetch(get_prefetch_executor(), current_q, ask_tool)
+
+            def tool_result(question, tool):
+                # 先読み済み（または先読み中）ならそれを使い、無ければその場で作る（ジョブとして動く）
+                text = tool_cache.get(question, tool)
+                if text is None:
+                    text = ask_tool(tool, QUESTION_TOOLS[tool](question))
+                    tool_cache.put(question, tool, text)
+                return text
+
+            def request_tool(tool):
+                # "hint:文の出だし（3語）" のようなツールも、枠は "hint" 1つにまとめる（新しく頼んだ方だけ表示する）
+                slot = tool.split(":")[0]
+                return jobs.submit(slot, f"{tool}|{current_q}", partial(tool_result, current_q, tool),
+                                   label=SITES[slot][0] + "を作成", cached=tool_cache.get(current_q, tool, wait=False))
+
+            def requested_tool(tool):
+                job = jobs.get(tool.split(":")[0], f"{tool}|{current_q}")
+                return job if job and job.done() else None
 
             if current_q:
                 with st.expander("🎧 リスニング確認クイズ"):
-                    if "quiz" not in st.session_state.tool_cache:
+                    quiz_data = tool_cache.get(current_q, "quiz", wait=False)
+                    if quiz_data is None:
+                        if tool_cache.is_pending(current_q, "quiz"):
+                            st.caption("⏳ 先読み中です。ボタンを押すと出来上がり次第表示します。")
                         if st.button("クイズを生成する"):
-                            with st.spinner("作成中..."):
-                                q_ai = genai.GenerativeModel(selected_model)
-                                quiz_prompt = f"""
-                                以下の英語セリフに対するリスニング3択クイズを作成してください。
-                                【厳守事項】
-                                ・「はい、作成します」などの前置きや、解説は【絶対】に出力しないこと。
-                                ・問題文と選択肢は1文で極力短くシンプルにすること。
-                                ・選択肢と正解の間に、必ず「---」という区切り線を入れてください。
-                                
-                                セリフ: {current_q}
-                                
-                                【出力フォーマット】
-                                Q. （短い問題文）
-                                1. （短い選択肢）
-                                2. （短い選択肢）
-                                3. （短い選択肢）
-                                ---
-                                正解: （番号のみ）
-                                """
-                                st.session_state.tool_cache["quiz"] = q_ai.generate_content(quiz_prompt).text
+                            if request_tool("quiz").done():
                                 st.rerun()
+                        quiz_job = requested_tool("quiz")
+                        if quiz_job and quiz_job.error:
+                            st.error("クイズの作成に失敗しました。")
                                 
-                    if "quiz" in st.session_state.tool_cache:
-                        quiz_data = st.session_state.tool_cache["quiz"]
+                    else:
                         if "---" in quiz_data:
                             q_part, a_part = quiz_data.split("---", 1)
                             st.markdown(q_part.strip())
@@ -338,12 +663,14 @@ if "chat_session" in st.session_state:
                             st.markdown(quiz_data)
 
             st.write("🇯🇵 **① 直前のセリフの日本語訳**")
-            if st.button("日本語訳を見る"):
-                if "translation" not in st.session_state.tool_cache:
-                    with st.spinner("翻訳中..."):
-                        t_ai = genai.GenerativeModel(selected_model)
-                        st.session_state.tool_cache["translation"] = t_ai.generate_content(f"以下を日本語に翻訳して:\n{current_q}").text
-                st.info(f"🇯🇵 {st.session_state.tool_cache['translation']}")
+            if st.button("日本語訳を見る") and current_q:
+                request_tool("translation")
+            translation_job = requested_tool("translation") if current_q else None
+            if translation_job:
+                if translation_job.error:
+                    st.error("翻訳中にエラーが発生しました。")
+                else:
+                    st.info(f"🇯🇵 {translation_job.result}")
 
             st.write("💡 **② お助け翻訳（言いたいことが英語で出てこない時）**")
             with st.form("translation_form", clear_on_submit=False):
@@ -354,80 +681,64 @@ if "chat_session" in st.session_state:
                     trans_btn = st.form_submit_button("英訳する🔄")
                     
             if trans_btn and jp_text:
-                with st.spinner("AIが英訳を考えています..."):
-                    try:
-                        translator = genai.GenerativeModel(selected_model)
-                        trans_prompt = f"以下の日本語を、英会話のセリフとして自然な英語に翻訳してください。出力は英語のセリフのみとし、解説や前置きは一切不要です。\n\n日本語: {jp_text}"
-                        trans_res = translator.generate_content(trans_prompt)
-                        st.success(f"✨ こんな風に言ってみましょう！\n\n### {trans_res.text.strip()}\n\n👆 少し上のマイクボタンを押して、声に出して読んでみてください。")
-                    except Exception as e:
-                        st.error("翻訳中にエラーが発生しました。")
+                jp_prompt = jp_to_en_prompt(jp_text.strip())
+                jobs.submit("jp_to_en", jp_prompt, partial(ask_model_cached, jp_prompt, "jp_to_en"), label="英訳を作成")
+            trans_job = jobs.get("jp_to_en")
+            if trans_job and trans_job.done():
+                if trans_job.error:
+                    st.error("翻訳中にエラーが発生しました。")
+                else:
+                    st.success(f"✨ こんな風に言ってみましょう！\n\n### {trans_job.result.strip()}\n\n👆 少し上のマイクボタンを押して、声に出して読んでみてください。")
 
             with st.form("dictionary_form", clear_on_submit=False):
                 st.write("📖 **③ 単語辞書 / 文法**")
                 dict_word = st.text_input("調べたい英単語や文法:", label_visibility="collapsed", placeholder="例: evidence, 現在完了形")
-                if st.form_submit_button("調べる🔍"):
-                    with st.spinner("検索中..."):
-                        d_ai = genai.GenerativeModel(selected_model)
-                        res = d_ai.generate_content(f"「{dict_word}」の意味と簡単な例文を1つ教えて。簡潔に。").text
-                        st.info(res)
+                if st.form_submit_button("調べる🔍") and dict_word.strip():
+                    dict_prompt = dictionary_prompt(dict_word.strip().lower() if dict_word.isascii() else dict_word.strip())
+                    jobs.submit("dictionary", dict_prompt, partial(ask_model_cached, dict_prompt, "dictionary"), label="辞書を検索")
+            dict_job = jobs.get("dictionary")
+            if dict_job and dict_job.done():
+                if dict_job.error:
+                    st.error("検索中にエラーが発生しました。")
+                else:
+                    st.info(dict_job.result)
 
             st.write("🧠 **④ ちょい足しヒント（自力で答えるためのアシスト）**")
             with st.form("hint_form", clear_on_submit=False):
                 hint_col1, hint_col2 = st.columns([3, 2])
                 with hint_col1:
-                    hint_type = st.selectbox("ヒントの種類", ["使うべき単語を3つ", "文の出だし（3語）", "日本語でのアイデア"], label_visibility="collapsed")
+                    hint_type = st.selectbox("ヒントの種類", HINT_TYPES, label_visibility="collapsed")
                 with hint_col2:
                     hint_btn = st.form_submit_button("ヒントをもらう🆘")
                     
                 if hint_btn:
-                    if last_msg and last_msg["role"] == "assistant" and "[英語の質問]" in last_msg["content"]:
-                        eng_q = last_msg["content"].split("[英語の質問]")[1].strip()
-                        with st.spinner("ヒントを作成中..."):
-                            try:
-                                hint_ai = genai.GenerativeModel(selected_model)
-                                if hint_type == "使うべき単語を3つ":
-                                    hint_prompt = f"以下の質問に答えるために役立つ英単語（または熟語）を3つだけ、日本語の意味を添えて箇条書きで教えてください。英語の正解は絶対に書かないでください。\n質問: {eng_q}"
-                                elif hint_type == "文の出だし（3語）":
-                                    hint_prompt = f"以下の質問に答えるための、自然な英文の書き出し（最初の3〜5語のみ）を1パターンだけ教えてください。日本語訳や解説、文の続きは書かないでください。\n質問: {eng_q}"
-                                else:
-                                    hint_prompt = f"以下の質問に対して、どのような内容を答えればよいか、日本語で簡潔に2つのアイデア（方向性）を提案してください。英語の解答例は書かないでください。\n質問: {eng_q}"
-                                hint_res = hint_ai.generate_content(hint_prompt)
-                                st.info(f"💡 **ヒント:**\n{hint_res.text.strip()}")
-                            except Exception as e:
-                                st.error("ヒントの作成に失敗しました。")
+                    if current_q:
+                        request_tool(f"hint:{hint_type}")
                     else:
                         st.warning("ヒントを出せる質問が見つかりませんでした。")
+            hint_job = jobs.get("hint")
+            if current_q and hint_job and hint_job.key.endswith(f"|{current_q}") and hint_job.done():
+                if hint_job.error:
+                    st.error("ヒントの作成に失敗しました。")
+                else:
+                    st.info(f"💡 **ヒント:**\n{hint_job.result.strip()}")
 
             st.write("🏳️ **⑤ どうしても答えられない時**")
-            if st.button("ギブアップ（解説と回答例を見て、リピート練習へ進む）"):
+            if st.button("ギブアップ（解説と回答例を見て、リピート練習へ進む）", disabled=evaluating):
                 st.session_state.stats_mistakes += 1
-                prompt = """
-                今の質問の意図がわかりません。通信量削減のため、無駄な前置きは一切省き、以下の構成で極めて簡潔に出力してください。今回は【新しい質問は行わず】、私がそのまま復唱できる回答例を提示してください。
-                
-                [フィードバック]
-                - 直前の質問の英語と日本語訳
-                - 質問の意図（1文で）
-                - この状況での自然な回答例の解説と、【★重要：その回答例の日本語訳】（絶対にここに書いてください）
-                
-                [リピート練習]
-                （私がそのまま復唱して答えるための、英語の回答例のセリフのみ。複数の場合は一番標準的なものを1つだけ。絶対に新しい質問はしないこと）
-                """
+                prompt = GIVEUP_PROMPT
                 display_prompt = "（🏳️ ギブアップして、解説と回答例をリクエストしました）"
 
-    # ＝＝＝ 送信処理（スマートトリミング適用） ＝＝＝
+    # ＝＝＝ 送信処理 ＝＝＝
     if prompt and display_prompt:
-        st.session_state.messages.append({"role": "user", "content": display_prompt})
-        st.session_state.tool_cache = {} 
-        
         with st.spinner("AIが返答を考えています..."):
             try:
-                trim_model = genai.GenerativeModel(selected_model, system_instruction=system_instruction)
-                st.session_state.chat_session = trim_model.start_chat(history=get_trimmed_history()[:-1])
-                response = st.session_state.chat_session.send_message(prompt)
-                st.session_state.messages.append({"role": "assistant", "content": response.text})
+                reply_text = send_chat(prompt)
+                # 発言は返答が確定してから記録する（ストリーミング中にボタン操作で再実行に割り込まれても、発言だけが残らないように）
+                st.session_state.messages.append(user_message(display_prompt))
+                reply = append_response(reply_text)
                 
-                if "[リピート練習]" in response.text:
+                if reply.is_practice:
                     st.session_state.stats_mistakes += 1
                     
                 st.rerun() 
@@ -435,7 +746,7 @@ if "chat_session" in st.session_state:
                 st.error("エラーが発生しました。")
 
 # === 評価処理 ===
-if end_button and "chat_session" in st.session_state:
+if end_button and "chat_manager" in st.session_state:
     with st.spinner("成績をまとめています..."):
         summary_prompt = """
         ここまでの会話を終了します。通信量削減のため、不要な前置きは省いてください。
@@ -454,10 +765,18 @@ if end_button and "chat_session" in st.session_state:
         【今後の課題・アドバイス】
         - （次に繋がるよう、優しくポジティブにアドバイス）
         """
-        st.session_state.messages.append({"role": "user", "content": "（終了して評価をリクエスト）"})
-        try:
-            res = st.session_state.chat_session.send_message(summary_prompt)
-            st.session_state.messages.append({"role": "assistant", "content": res.text})
-            st.rerun()
-        except Exception:
-            st.error("評価の作成に失敗しました。")
+        # 評価は時間がかかるので重い処理のレーンで作り、待っている間もお助けツールなどは使えるようにする
+        # キーは会話IDと画面のメッセージ数から作る（ChatManager の履歴の長さは刈り込みで行き来するので使わない）
+        manager = st.session_state.chat_manager
+        evaluation_key = f"{st.session_state.conversation_id}:{len(st.session_state.messages)}"
+        previous = jobs.get("evaluation", evaluation_key)
+        if previous is None or previous.error:
+            jobs.submit("evaluation", evaluation_key, partial(send_chat_blocking, manager, summary_prompt, doc_context(summary_prompt), "evaluation"),
+                        lane="slow", label="成績をまとめ")
+        st.rerun()
+
+# このスクリプト実行中に投げたジョブも見張れるよう、様子見は一番最後に置く
+# 描画の途中で終わったジョブ（上の newly_finished() の後に終わったもの）も、次の確認で画面全体を描き直す
+if jobs.pending() or jobs.has_unnotified():
+    with st.sidebar:
+        job_progress()
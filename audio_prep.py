@@ -0,0 +1,164 @@
+# === 🎧 録音の下ごしらえ（無音カット・16kHzモノラル化・圧縮） ===
+# st.audio_input の録音はWAVのままで大きく、マイクを押してから話し始めるまでの無音も入っている。
+# 文字起こし・発音判定に送る前に、手元で
+#   ・前後の無音を切り落とす（短い区間ごとの音量で判定）
+#   ・ステレオなら1チャンネルにまとめ、16kHzに間引く（音声認識にはこれで十分）
+#   ・soundfile が入っていればFLACに、無ければ16bitのWAVにする
+# だけを行う。外部のサービスは使わない。読めない形式の時は元の音声をそのまま送る。
+import io
+import sys
+import wave
+from array import array
+from dataclasses import dataclass
+
+try:
+    import soundfile
+except ImportError:     # 無くても動く（FLACにしないだけ）
+    soundfile = None
+
+TARGET_RATE = 16000
+FRAME_MS = 20
+PADDING_MS = 200        # 切り落とす時に、声の前後に残す余白
+SILENCE_FLOOR = 300     # これより小さい音量（16bitの振幅の二乗平均平方根）は常に無音扱い
+SILENCE_RATIO = 0.1     # 一番大きいフレームの音量の、この割合に満たないフレームも無音扱い
+
+
+def can_encode_flac():
+    return soundfile is not None
+
+
+@dataclass(slots=True)
+class PreparedAudio:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_seconds: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def reduction(self):
+        """元の大きさから何割減ったか（0〜1）。"""
+        if not self.original_bytes:
+            return 0.0
+        return max(0.0, 1 - len(self.data) / self.original_bytes)
+
+    def describe(self):
+        return (f"🎧 送信サイズ {self.original_bytes / 1024:.0f}KB → {len(self.data) / 1024:.0f}KB（-{self.reduction:.0%}）"
+                f" / 長さ {self.original_seconds:.1f}秒 → {self.seconds:.1f}秒")
+
+
+def read_wav(data):
+    """WAVのバイト列を (チャンネルごとに交互に並んだ16bitのサンプル, チャンネル数, サンプリング周波数) にする。"""
+    with wave.open(io.BytesIO(data), "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        # 8bitは0〜255の符号なし
+        samples = array("h", ((b - 128) << 8 for b in raw))
+    elif width == 2:
+        samples = array("h")
+        samples.frombytes(raw)
+        if sys.byteorder == "big":
+            samples.byteswap()
+    elif width == 3:
+        samples = array("h", (int.from_bytes(raw[i + 1:i + 3], "little", signed=True) for i in range(0, len(raw) - 2, 3)))
+    elif width == 4:
+        wide = array("i")
+        wide.frombytes(raw)
+        if sys.byteorder == "big":
+            wide.byteswap()
+        samples = array("h", (s >> 16 for s in wide))
+    else:
+        raise ValueError(f"unsupported sample width: {width}")
+    return samples, channels, rate
+
+
+def to_mono(samples, channels):
+    if channels == 1:
+        return samples
+    return array("h", (sum(samples[i:i + channels]) // channels for i in range(0, len(samples) - channels + 1, channels)))
+
+
+def resample(samples, rate, target_rate=TARGET_RATE):
+    """線形補間で周波数を変える。元が低ければそのまま（わざわざ大きくしない）。"""
+    if rate <= target_rate or not samples:
+        return samples, rate
+    step = rate / target_rate
+    last = len(samples) - 1
+    out = array("h")
+    for n in range(int(len(samples) / step)):
+        pos = n * step
+        i = int(pos)
+        frac = pos - i
+        nxt = samples[i + 1] if i < last else samples[i]
+        out.append(int(samples[i] + (nxt - samples[i]) * frac))
+    return out, target_rate
+
+
+def frame_levels(samples, frame_len):
+    levels = []
+    for start in range(0, len(samples), frame_len):
+        frame = samples[start:start + frame_len]
+        levels.append((sum(s * s for s in frame) / len(frame)) ** 0.5)
+    return levels
+
+
+def trim_silence(samples, rate):
+    """前後の無音を切り落とす。声らしい区間が見つからなければ何もしない。"""
+    frame_len = max(1, rate * FRAME_MS // 1000)
+    levels = frame_levels(samples, frame_len)
+    if not levels:
+        return samples
+    threshold = max(SILENCE_FLOOR, max(levels) * SILENCE_RATIO)
+    voiced = [i for i, level in enumerate(levels) if level >= threshold]
+    if not voiced:
+        return samples
+    pad = rate * PADDING_MS // 1000
+    start = max(0, voiced[0] * frame_len - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame_len + pad)
+    return samples[start:end]
+
+
+def encode_wav(samples, rate):
+    if sys.byteorder == "big":
+        samples = array("h", samples)
+        samples.byteswap()
+    fp = io.BytesIO()
+    with wave.open(fp, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return fp.getvalue()
+
+
+def encode_flac(samples, rate):
+    fp = io.BytesIO()
+    soundfile.write(fp, memoryview(samples), rate, format="FLAC", subtype="PCM_16")
+    return fp.getvalue()
+
+
+def prepare_audio(data, trim=True, flac=True):
+    """録音を送信用に小さくする。扱えない形式なら元のまま返す。"""
+    try:
+        samples, channels, rate = read_wav(data)
+    except (wave.Error, EOFError, ValueError):
+        return PreparedAudio(data, "audio/wav", len(data))
+    original_seconds = len(samples) / channels / rate if rate else 0.0
+    samples = to_mono(samples, channels)
+    samples, rate = resample(samples, rate)
+    if trim:
+        samples = trim_silence(samples, rate)
+    mime_type = "audio/wav"
+    if flac and can_encode_flac():
+        try:
+            out = encode_flac(samples, rate)
+            mime_type = "audio/flac"
+        except Exception:
+            out = encode_wav(samples, rate)
+    else:
+        out = encode_wav(samples, rate)
+    if len(out) >= len(data):
+        # 小さくならなかった（もともと16kHzモノラルで無音も無い等）なら、元のまま送る
+        return PreparedAudio(data, "audio/wav", len(data), original_seconds, original_seconds)
+    return PreparedAudio(out, mime_type, len(data), original_seconds, len(samples) / rate)
@@ -0,0 +1,201 @@
+# === 🧪 ベンチマーク用の偽バックエンド（Gemini / gTTS） ===
+# APIを使わずに app.py を動かすための、google.generativeai と gtts の代役。
+# 録音した返答（JSONL）があればそれを順番に返し、無ければ定型の返答を作る。待ち時間も指定できる。
+import itertools
+import json
+import sys
+import threading
+import time
+import types
+from collections import Counter
+
+QUESTIONS = [
+    "What are you going to do this weekend?",
+    "Do you like **cooking** at home?",
+    "Where did you go on your last holiday?",
+    "What kind of music do you listen to?",
+    "How do you usually get to work?",
+]
+
+
+def classify(contents):
+    """送られてきた内容から、どの呼び出しか（chat / quiz / judge など）を判定する。"""
+    if isinstance(contents, str):
+        text = contents
+        if "リスニング3択クイズ" in text:
+            return "quiz"
+        if "自然な英語に翻訳" in text:
+            return "jp_to_en"
+        if "日本語に翻訳して" in text:
+            return "translation"
+        if "の意味と簡単な例文" in text:
+            return "dictionary"
+        if "これまでの要約" in text:
+            return "history_summary"
+        if "質問:" in text:
+            return "hint"
+        return "other"
+    has_audio = any(isinstance(c, dict) and "mime_type" in c for c in contents)
+    if has_audio:
+        return "judge" if any(isinstance(c, str) and "お手本" in c for c in contents) else "transcribe"
+    last = contents[-1]["parts"][0] if contents and isinstance(contents[-1], dict) else ""
+    if "会話を終了します" in last:
+        return "evaluation"
+    if "意図がわかりません" in last:
+        return "giveup"
+    if "全く同じ質問文" in last:
+        return "repeat"
+    return "chat"
+
+
+class FakeBackend:
+    """偽のAPIの状態（返答の順番、呼び出し回数、待ち時間）。"""
+
+    def __init__(self, latency=0.0, tts_latency=0.0, replay_path=None, stream_chunks=4):
+        self.latency = latency
+        self.tts_latency = tts_latency
+        self.stream_chunks = stream_chunks
+        self.calls = Counter()
+        self.upload_bytes = 0
+        self._lock = threading.Lock()
+        self._question_no = itertools.count()
+        self._last_question = QUESTIONS[0]
+        self._replay = {}
+        if replay_path:
+            by_kind = {}
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        by_kind.setdefault(item["kind"], []).append(item["text"])
+            self._replay = {kind: itertools.cycle(texts) for kind, texts in by_kind.items()}
+
+    def count(self, kind, upload_bytes=0):
+        with self._lock:
+            self.calls[kind] += 1
+            self.upload_bytes += upload_bytes
+
+    def reply(self, kind):
+        with self._lock:
+            if kind in self._replay:
+                return next(self._replay[kind])
+            if kind == "chat":
+                self._last_question = QUESTIONS[next(self._question_no) % len(QUESTIONS)]
+                return f"[フィードバック]\n- いいですね！自然な英語です。\n[英語の質問]\n{self._last_question}"
+            if kind == "repeat":
+                return f"[フィードバック]\n- もう一度言いますね。\n[英語の質問]\n{self._last_question}"
+            if kind == "giveup":
+                return ("[フィードバック]\n- 質問の意図: 週末の予定を聞いています。\n- 和訳: 友達と映画を見に行きます。\n"
+                        "[リピート練習]\nI am going to see a movie with my friends.")
+            if kind == "evaluation":
+                return "【本日のスコア】\n- 文法: 80/100点\n- 総合スコア: 82/100点\n【良かった点】\n- 積極的でした！"
+            if kind == "quiz":
+                return "Q. 何について聞かれていますか？\n1. 週末\n2. 仕事\n3. 天気\n---\n正解: 1"
+            if kind in ("transcribe",):
+                return "I am going to see a movie with my friends."
+            if kind == "judge":
+                return json.dumps({"transcript": "I am going to see a movie with my friend.", "match": False,
+                                   "correction": "friends の s が抜けています。"}, ensure_ascii=False)
+            if kind == "history_summary":
+                return "- 学習者は週末の予定について話した。"
+            return f"（{kind} のダミー返答）"
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+
+
+class _Response:
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        self.parts = [text] if text else []
+        self.usage_metadata = _Usage(prompt_tokens, len(text) // 4)
+
+
+def _content_size(contents):
+    if isinstance(contents, str):
+        return len(contents), 0
+    chars, audio = 0, 0
+    for c in contents:
+        if isinstance(c, str):
+            chars += len(c)
+        elif "data" in c:
+            audio += len(c["data"])
+        else:
+            chars += sum(len(p) for p in c.get("parts", []) if isinstance(p, str))
+    return chars, audio
+
+
+def make_genai_module(backend):
+    genai = types.ModuleType("google.generativeai")
+
+    class GenerativeModel:
+        def __init__(self, model_name="fake", system_instruction=None, generation_config=None, **kwargs):
+            self.model_name = model_name
+            self.system_instruction = system_instruction or ""
+
+        @classmethod
+        def from_cached_content(cls, cached_content, **kwargs):
+            return cls(cached_content.model)
+
+        def generate_content(self, contents, stream=False, **kwargs):
+            kind = classify(contents)
+            chars, audio = _content_size(contents)
+            backend.count(kind, audio)
+            text = backend.reply(kind)
+            prompt_tokens = (chars + len(self.system_instruction)) // 2
+            if not stream:
+                time.sleep(backend.latency)
+                return _Response(text, prompt_tokens)
+            return self._stream(text, prompt_tokens)
+
+        def _stream(self, text, prompt_tokens):
+            n = max(1, backend.stream_chunks)
+            size = -(-len(text) // n)
+            for i in range(0, len(text), size):
+                time.sleep(backend.latency / n)
+                yield _Response(text[i:i + size], prompt_tokens)
+
+    class CachedContent:
+        @classmethod
+        def create(cls, **kwargs):
+            # 偽物ではコンテキストキャッシュは使えない扱いにする（app側は通常のモデルで続ける）
+            raise RuntimeError("context caching is not available in the fake backend")
+
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = GenerativeModel
+    genai.caching = types.ModuleType("google.generativeai.caching")
+    genai.caching.CachedContent = CachedContent
+    return genai
+
+
+def make_gtts_module(backend):
+    gtts = types.ModuleType("gtts")
+
+    class gTTS:
+        def __init__(self, text, lang="en", slow=False, **kwargs):
+            self.text = text
+
+        def write_to_fp(self, fp):
+            backend.count("tts")
+            time.sleep(backend.tts_latency)
+            # 本物のMP3の代わりに、文字数に比例した大きさのダミーデータを書く
+            fp.write(b"ID3" + b"\0" * (len(self.text) * 200))
+
+    gtts.gTTS = gTTS
+    return gtts
+
+
+def install(backend):
+    """sys.modules に偽物を登録する。app.py を読み込む前に呼ぶこと。"""
+    genai = make_genai_module(backend)
+    google = sys.modules.get("google") or types.ModuleType("google")
+    if not hasattr(google, "__path__"):
+        google.__path__ = []
+    google.generativeai = genai
+    sys.modules["google"] = google
+    sys.modules["google.generativeai"] = genai
+    sys.modules["google.generativeai.caching"] = genai.caching
+    sys.modules["gtts"] = make_gtts_module(backend)
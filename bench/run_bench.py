@@ -0,0 +1,289 @@
+# === 🧪 オフライン・ベンチマーク ===
+# 偽のGemini/gTTSで app.py を画面なしで動かし（Streamlit の AppTest）、会話が長くなった時の
+#   ・1回の再実行（ボタン操作）にかかる時間
+#   ・st.session_state の大きさ
+#   ・API / 音声生成の呼び出し回数
+#   ・録音の下ごしらえ（audio_prep）の時間と、送信した音声の大きさ
+# を測る。APIの利用枠は一切使わない。
+#
+# AppTest からは st.audio_input に録音を渡せないので、文字起こし・発音判定は app.py と同じ手順のジョブを
+# 合成した録音（前後に無音のある44.1kHzステレオのWAV）で直接投げる。文字起こしの結果は app.py が受け取って
+# 会話のターンとして送るが、発音判定の結果の表示は録音ウィジェットの値が要るので測れない（呼び出しと送信量だけ）。
+#
+# 使い方（リポジトリの一番上で）:
+#   python bench/run_bench.py --checkpoints 5 20 50 100 200 --latency 0.05
+#   python bench/run_bench.py --replay recorded.jsonl --json result.json
+# --replay には {"kind": "chat", "text": "..."} の形の行を並べたJSONLを渡す（kind は fake_backends.classify の分類）。
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+import wave
+from array import array
+
+from fake_backends import FakeBackend, install
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from audio_prep import prepare_audio  # noqa: E402
+from model_router import FAST_MODEL  # noqa: E402
+from pronunciation import build_judge_prompt, parse_judge_result  # noqa: E402
+
+
+def deep_sizeof(obj, seen=None):
+    """オブジェクトが参照している中身まで含めた、おおよそのメモリ使用量（バイト）。"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, s), seen) for s in obj.__slots__ if hasattr(obj, s))
+    return size
+
+
+def synthetic_wav(silence_seconds=1.0, voice_seconds=2.0, rate=44100, channels=2):
+    """マイクの録音の代わり。前後に無音があり、間に220Hzの音が入った16bitのWAV。"""
+    silence, voice = int(rate * silence_seconds), int(rate * voice_seconds)
+    samples = array("h")
+    for n in range(silence * 2 + voice):
+        level = int(8000 * math.sin(2 * math.pi * 220 * n / rate)) if silence <= n < silence + voice else 0
+        samples.extend([level] * channels)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    fp = io.BytesIO()
+    with wave.open(fp, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return fp.getvalue()
+
+
+class AudioJobs:
+    """app.py の transcribe() / judge_pronunciation() と同じ手順のジョブ（下ごしらえの時間と大きさも記録する）。"""
+
+    def __init__(self, wav):
+        self.wav = wav
+        self.prep_ms = []
+        self.original_bytes = 0
+        self.sent_bytes = 0
+
+    def _prepare(self):
+        start = time.perf_counter()
+        audio = prepare_audio(self.wav)
+        self.prep_ms.append((time.perf_counter() - start) * 1000)
+        self.original_bytes += audio.original_bytes
+        self.sent_bytes += len(audio.data)
+        return audio
+
+    def transcribe(self):
+        import google.generativeai as genai
+        audio = self._prepare()
+        res = genai.GenerativeModel(FAST_MODEL).generate_content(
+            [{"mime_type": audio.mime_type, "data": audio.data}, "英語を文字起こししてください。文字のみ出力。"])
+        return audio, res.text.strip() if res.parts else ""
+
+    def judge(self, target):
+        import google.generativeai as genai
+        audio = self._prepare()
+        res = genai.GenerativeModel(FAST_MODEL, generation_config={"response_mime_type": "application/json"}).generate_content(
+            [{"mime_type": audio.mime_type, "data": audio.data}, build_judge_prompt(target)])
+        return audio, parse_judge_result(res.text if res.parts else "")
+
+
+def session_state_size(at):
+    state = at.session_state
+    items = getattr(state, "filtered_state", None)
+    if items is None:
+        items = {k: state[k] for k in state}
+    return deep_sizeof(dict(items))
+
+
+class Driver:
+    """AppTest を操作して、ボタン操作1回ごとの時間を測る。"""
+
+    def __init__(self, at, timeout):
+        self.at = at
+        self.timeout = timeout
+        self.rerun_ms = []
+
+    def _timed(self, action):
+        start = time.perf_counter()
+        action()
+        self.rerun_ms.append((time.perf_counter() - start) * 1000)
+        if self.at.exception:
+            raise RuntimeError(f"app raised: {self.at.exception[0].value}")
+
+    def run(self):
+        self._timed(lambda: self.at.run(timeout=self.timeout))
+
+    def click(self, label_prefix):
+        button = next((b for b in self.at.button if b.label.startswith(label_prefix)), None)
+        if button is None:
+            raise RuntimeError(f"button not found: {label_prefix}")
+        self._timed(lambda: button.click().run(timeout=self.timeout))
+
+    def wait_for_jobs(self):
+        """バックグラウンドのジョブが終わるのを待って、結果を描画する再実行を1回測る（画面では st.fragment の定期確認が行う）。"""
+        jobs = self.at.session_state["jobs"]
+        if not jobs.pending():
+            return
+        while jobs.pending():
+            time.sleep(0.005)
+        self.run()
+
+    def submit_job(self, slot, fn):
+        """録音のボタンを押した時と同じように、ジョブを投げて結果が描画されるまでを測る。"""
+        self.at.session_state["jobs"].submit(slot, f"bench-{time.perf_counter()}", fn, label=slot)
+        self.wait_for_jobs()
+        if self.at.exception:
+            raise RuntimeError(f"app raised: {self.at.exception[0].value}")
+
+    def has_button(self, label_prefix):
+        return any(b.label.startswith(label_prefix) for b in self.at.button)
+
+
+def one_turn(driver, audio_jobs, turn_no):
+    """1ターン分の操作。3ターンごとに「質問の繰り返しを頼む」「録音で答える（文字起こし→送信）」
+    「ギブアップ→発音判定→次へ」を順に行う。
+
+    どの場合もターンの最後は通常モード（お助けツールが使える状態）に戻る。
+    """
+    if turn_no % 3 == 0:
+        driver.click("🔄 今の質問をもう一度聞く")
+    elif turn_no % 3 == 1:
+        driver.submit_job("transcribe", audio_jobs.transcribe)
+    else:
+        driver.click("ギブアップ")
+        target = driver.at.session_state["messages"][-1].target
+        driver.submit_job("judge", lambda: audio_jobs.judge(target))
+        driver.click("▶️ 練習完了")
+
+
+def use_helper_tools(driver):
+    for label in ("日本語訳を見る", "クイズを生成する", "ヒントをもらう"):
+        if driver.has_button(label):
+            driver.click(label)
+            driver.wait_for_jobs()
+
+
+def run(args):
+    from streamlit.testing.v1 import AppTest
+
+    # 非推奨の警告などで結果が読みにくくならないよう、警告以下のログは出さない
+    logging.disable(logging.WARNING)
+
+    backend = FakeBackend(latency=args.latency, tts_latency=args.tts_latency, replay_path=args.replay)
+    install(backend)
+    audio_jobs = AudioJobs(synthetic_wav())
+    # キャッシュ（.app_cache）は毎回まっさらな一時フォルダに作る
+    os.chdir(tempfile.mkdtemp(prefix="roleplay-bench-"))
+
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets["GEMINI_API_KEY"] = "fake-key"
+    at.session_state["password_correct"] = True
+    driver = Driver(at, args.timeout)
+    driver.run()
+    baseline_state = session_state_size(at)
+    driver.click("▶️ 会話をリセットしてスタート")
+
+    results = []
+    checkpoints = sorted(set(args.checkpoints))
+    turns_done = 0
+    for checkpoint in checkpoints:
+        driver.rerun_ms.clear()
+        calls_before = sum(backend.calls.values())
+        while turns_done < checkpoint:
+            one_turn(driver, audio_jobs, turns_done)
+            turns_done += 1
+        turn_ms = list(driver.rerun_ms)
+
+        # 何もしない再実行（ウィジェットを触った時と同じ）を数回測る
+        driver.rerun_ms.clear()
+        for _ in range(args.idle_reruns):
+            driver.run()
+        idle_ms = list(driver.rerun_ms)
+
+        driver.rerun_ms.clear()
+        use_helper_tools(driver)
+        tool_ms = list(driver.rerun_ms)
+
+        results.append({
+            "turns": checkpoint,
+            "messages": len(at.session_state["messages"]),
+            "turn_rerun_ms_p50": round(statistics.median(turn_ms), 1) if turn_ms else 0.0,
+            "idle_rerun_ms_p50": round(statistics.median(idle_ms), 1) if idle_ms else 0.0,
+            "idle_rerun_ms_max": round(max(idle_ms), 1) if idle_ms else 0.0,
+            "tool_rerun_ms_p50": round(statistics.median(tool_ms), 1) if tool_ms else 0.0,
+            "session_state_kb": round(session_state_size(at) / 1024, 1),
+            "session_state_growth_kb": round((session_state_size(at) - baseline_state) / 1024, 1),
+            "api_calls_since_last": sum(backend.calls.values()) - calls_before,
+        })
+
+    driver.rerun_ms.clear()
+    driver.click("🛑 会話を終了して評価をもらう")
+    driver.wait_for_jobs()
+    return {
+        "checkpoints": results,
+        "evaluation_ms": round(driver.rerun_ms[-1], 1),
+        "calls": dict(sorted(backend.calls.items())),
+        "audio_upload_bytes": backend.upload_bytes,
+        "audio_original_bytes": audio_jobs.original_bytes,
+        "audio_prep_ms_p50": round(statistics.median(audio_jobs.prep_ms), 1) if audio_jobs.prep_ms else 0.0,
+        "settings": vars(args),
+    }
+
+
+def print_report(report):
+    cols = ["turns", "messages", "turn_rerun_ms_p50", "idle_rerun_ms_p50", "idle_rerun_ms_max",
+            "tool_rerun_ms_p50", "session_state_kb", "session_state_growth_kb", "api_calls_since_last"]
+    widths = [max(len(c), 8) for c in cols]
+    print("  ".join(c.rjust(w) for c, w in zip(cols, widths)))
+    for row in report["checkpoints"]:
+        print("  ".join(str(row[c]).rjust(w) for c, w in zip(cols, widths)))
+    print(f"\nevaluation rerun: {report['evaluation_ms']} ms")
+    print("calls:", ", ".join(f"{k}={v}" for k, v in report["calls"].items()))
+    if report["audio_original_bytes"]:
+        print(f"audio: {report['audio_original_bytes'] / 1024:.0f} KB recorded -> {report['audio_upload_bytes'] / 1024:.0f} KB sent"
+              f" (audio_prep p50 {report['audio_prep_ms_p50']} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="偽バックエンドで app.py の再実行コストを測る")
+    parser.add_argument("--checkpoints", type=int, nargs="+", default=[5, 20, 50, 100, 200], help="計測するターン数")
+    parser.add_argument("--latency", type=float, default=0.0, help="偽Geminiの1回あたりの待ち時間（秒）")
+    parser.add_argument("--tts-latency", type=float, default=0.0, help="偽gTTSの1回あたりの待ち時間（秒）")
+    parser.add_argument("--idle-reruns", type=int, default=3, help="各計測点で測る「何もしない再実行」の回数")
+    parser.add_argument("--replay", help="録音した返答のJSONL")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+    # 実行中は一時フォルダに移動するので、パスは先に絶対パスにしておく
+    args.json = os.path.abspath(args.json) if args.json else None
+    args.replay = os.path.abspath(args.replay) if args.replay else None
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
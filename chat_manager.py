@@ -0,0 +1,258 @@
+# === 💬 会話セッションの管理 ===
+# 会話ごとにモデルを1つだけ作って使い回し、履歴には1ターンずつ追記していく。
+# 履歴はメッセージごとのトークン数で管理し、上限を超えた時だけ古いターンを「これまでの要約」に畳み込む。
+# （上限を超えるまで履歴の形が変わらないので、Gemini側の暗黙キャッシュも効きやすい）
+# 指示書（system instruction）が十分に長い時は、Geminiのコンテキストキャッシュに載せて毎回の送信量を減らす。
+# （標準の設定の指示書は約700トークンで対象外。役柄・状況・テーマを長く書いた時だけ使われる）
+import datetime
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import google.generativeai as genai
+
+from doc_index import estimate_tokens
+from perf import PerfEvent
+
+# これより短い指示書はコンテキストキャッシュの対象外（APIの最小トークン数）
+CONTEXT_CACHE_MIN_TOKENS = 1024
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+# キャッシュの期限がこれより近づいたら、使う前に期限を延ばす（1時間を超える会話でも切れないように）
+CONTEXT_CACHE_REFRESH_MARGIN = datetime.timedelta(minutes=10)
+# 刈り込む時は上限のこの割合まで減らす（毎ターン要約し直さないための余裕）
+COMPACT_TO_RATIO = 0.6
+SUMMARY_MAX_CHARS = 600
+
+# 要約は返答の表示を待たせないよう、バックグラウンドで作る（サーバー全体で共有）
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+# 使わなくなったコンテキストキャッシュの削除も、画面を待たせないようバックグラウンドで行う
+_cache_cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-cache-cleanup")
+
+
+def build_summary_prompt(summary, turns):
+    lines = [f"{'学習者' if t['role'] == 'user' else 'AI'}: {t['parts'][0]}" for t in turns]
+    joined = "\n".join(lines)
+    return f"""
+英会話ロールプレイの「これまでの要約」を更新してください。
+【今までの要約】
+{summary or "（なし）"}
+
+【要約に追加する会話】
+{joined}
+
+【厳守事項】
+・学習者の名前や呼ばれ方、役柄と状況、話題の流れ、学習者がしたミスと練習した表現を必ず残すこと。
+・日本語の箇条書きで{SUMMARY_MAX_CHARS}文字以内。前置きは不要。
+"""
+
+
+def _delete_quietly(cached):
+    try:
+        cached.delete()
+    except Exception:
+        # 期限切れ・削除済みなら何もしなくてよい
+        pass
+
+
+def _signature(model_name, system_instruction):
+    return hashlib.sha256(f"{model_name}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+
+class ChatManager:
+    def __init__(self, model_name, system_instruction, history_token_budget=2000, summary_model_name="gemini-2.5-flash-lite", use_context_cache=True):
+        self.history_token_budget = history_token_budget
+        self.summary_model_name = summary_model_name
+        self.use_context_cache = use_context_cache
+        self.history = []           # [{"role": "user" | "model", "parts": [テキスト]}]
+        self._tokens = []           # history と同じ並びの、メッセージごとのトークン数
+        self.summary = ""           # 履歴から外れたターンの要約
+        self._unsummarized = []     # 履歴から外したが、まだ要約に入っていないターン
+        self._summarizing = []      # いま要約を作っている最中のターン
+        self._summary_future = None
+        self.context_cached = False
+        self.recorder = None        # perf.PerfRecorder（任意）
+        self.configure(model_name, system_instruction)
+
+    def configure(self, model_name, system_instruction):
+        """モデル名か指示書が変わった時だけモデルを作り直す。履歴はそのまま引き継ぐ。
+
+        モデル（とコンテキストキャッシュ）は次に送信する時に作る。設定欄を書き換えるたびにAPIを待たせないため。
+        """
+        signature = _signature(model_name, system_instruction)
+        if getattr(self, "signature", None) == signature:
+            return
+        self.close()
+        self.signature = signature
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self._models = {}           # モデル名 → GenerativeModel（切り替え先のモデルも同じ指示書で作る）
+        self._cached_contents = {}  # モデル名 → (CachedContent, 期限の time.monotonic())
+
+    def close(self):
+        """作ったコンテキストキャッシュを消す（期限まで課金され続けないように）。会話をやめる時にも呼ぶ。"""
+        for cached, _ in getattr(self, "_cached_contents", {}).values():
+            _cache_cleanup_executor.submit(_delete_quietly, cached)
+        self._cached_contents = {}
+        self._models = {}
+
+    def model_for(self, model_name):
+        model = self._models.get(model_name)
+        if model is not None and model_name in self._cached_contents:
+            model = self._keep_cache_alive(model_name, model)
+        if model is None:
+            model = self._models[model_name] = self._build_model(model_name, self.system_instruction)
+        return model
+
+    def _keep_cache_alive(self, model_name, model):
+        """コンテキストキャッシュの期限が近ければ延ばす。延ばせなければ None（モデルを作り直す）。"""
+        cached, expires_at = self._cached_contents[model_name]
+        now = time.monotonic()
+        if expires_at - now > CONTEXT_CACHE_REFRESH_MARGIN.total_seconds():
+            return model
+        try:
+            cached.update(ttl=CONTEXT_CACHE_TTL)
+            self._cached_contents[model_name] = (cached, now + CONTEXT_CACHE_TTL.total_seconds())
+            return model
+        except Exception:
+            # もう期限切れ・削除済みなら、新しいキャッシュで作り直す
+            del self._cached_contents[model_name]
+            return None
+
+    def _build_model(self, model_name, system_instruction):
+        self.context_cached = False
+        if self.use_context_cache and estimate_tokens(system_instruction) >= CONTEXT_CACHE_MIN_TOKENS:
+            try:
+                from google.generativeai import caching
+                cached = caching.CachedContent.create(
+                    model=f"models/{model_name}",
+                    system_instruction=system_instruction,
+                    ttl=CONTEXT_CACHE_TTL,
+                )
+                self._cached_contents[model_name] = (cached, time.monotonic() + CONTEXT_CACHE_TTL.total_seconds())
+                self.context_cached = True
+                return genai.GenerativeModel.from_cached_content(cached_content=cached)
+            except Exception:
+                # キャッシュが使えないモデルや古いライブラリでは、普通のモデルで続ける
+                pass
+        return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+    def history_tokens(self):
+        return sum(self._tokens)
+
+    def prepare(self, prompt, context=""):
+        """今回送る内容（要約＋履歴＋今回の発言）を作る。generate() に渡して、返答を commit() する。"""
+        return self._contents(prompt, context)
+
+    def _contents(self, prompt, context):
+        self._adopt_summary()
+        # 資料の抜粋などその場限りの情報は、今回の送信にだけ付けて履歴には残さない
+        turn = f"{context}\n\n{prompt}" if context else prompt
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": [f"（これまでの会話の要約）\n{self.summary}"]})
+            contents.append({"role": "model", "parts": ["了解しました。この内容を踏まえて会話を続けます。"]})
+        # 要約が出来上がるまでは、外したターンもそのまま送る（その間に文脈が抜けないように）
+        return contents + self._summarizing + self._unsummarized + self.history + [{"role": "user", "parts": [turn]}]
+
+    def commit(self, prompt, reply):
+        self._record(prompt, reply)
+
+    def _record(self, prompt, reply):
+        for role, text in (("user", prompt), ("model", reply)):
+            self.history.append({"role": role, "parts": [text]})
+            self._tokens.append(estimate_tokens(text))
+        self._compact()
+
+    def _compact(self):
+        if self.history_tokens() <= self.history_token_budget:
+            return
+        target = int(self.history_token_budget * COMPACT_TO_RATIO)
+        # 直近の1往復は必ず残す。古い方から1往復ずつ外す
+        while len(self.history) > 2 and self.history_tokens() > target:
+            self._unsummarized.extend(self.history[:2])
+            del self.history[:2]
+            del self._tokens[:2]
+        self._refresh_summary()
+
+    def _refresh_summary(self):
+        if not self._unsummarized or self._summary_future is not None:
+            # 要約を作っている最中なら、終わった時に残りをまとめて畳み込む
+            return
+        turns, self._unsummarized = self._unsummarized, []
+        self._summarizing = turns
+        self._summary_future = _summary_executor.submit(self._summarize, self.summary, turns)
+
+    def _summarize(self, summary, turns):
+        try:
+            model = genai.GenerativeModel(self.summary_model_name)
+            with self._track("history_summary", self.summary_model_name) as event:
+                response = model.generate_content(build_summary_prompt(summary, turns))
+                event.set_usage(response)
+            return response.text.strip()[:SUMMARY_MAX_CHARS * 2]
+        except Exception:
+            # 要約に失敗しても、最低限の内容は残しておく
+            lines = [summary] + [f"- {t['parts'][0][:80]}" for t in turns if t["role"] == "user"]
+            return "\n".join(line for line in lines if line)[-SUMMARY_MAX_CHARS:]
+
+    def _adopt_summary(self):
+        future = self._summary_future
+        if future is None or not future.done():
+            return
+        self._summary_future = None
+        self._summarizing = []
+        self.summary = future.result()
+        self._refresh_summary()
+
+    def _track(self, kind, model_name):
+        return self.recorder.track(kind, model_name) if self.recorder is not None else nullcontext(PerfEvent())
+
+    def generate(self, contents, kind="chat", model_name=None, timeout=None):
+        """prepare() で作った内容を送り、返答の文字列を返す。履歴は変えない（別スレッドから同時に呼んでもよい）。"""
+        model_name = model_name or self.model_name
+        request_options = {"timeout": timeout} if timeout else None
+        with self._track(kind, model_name) as event:
+            response = self.model_for(model_name).generate_content(contents, request_options=request_options)
+            event.set_usage(response)
+        return response.text
+
+    def send(self, prompt, context="", kind="chat", model_name=None, timeout=None):
+        reply = self.generate(self._contents(prompt, context), kind, model_name, timeout)
+        self._record(prompt, reply)
+        return reply
+
+    def stream(self, prompt, context="", kind="chat", model_name=None, timeout=None):
+        """返答を届いた順に少しずつ返すジェネレーター。最後まで読み切った時に履歴へ追記する。
+
+        途中で読むのをやめた（画面の再実行に割り込まれた等）時は、今回の発言も返答も履歴に残さない。
+        """
+        model_name = model_name or self.model_name
+        request_options = {"timeout": timeout} if timeout else None
+        reply = ""
+        with self._track(kind, model_name) as event:
+            for chunk in self.model_for(model_name).generate_content(self._contents(prompt, context), stream=True, request_options=request_options):
+                # トークン数は最後のチャンクに入ってくる
+                event.set_usage(chunk)
+                if not chunk.parts:
+                    continue
+                reply += chunk.text
+                yield chunk.text
+        self._record(prompt, reply)
+
+    def state(self):
+        """保存用の中身（要約・まだ要約に入っていないターン・履歴）。JSONにできる形で返す。"""
+        return {"summary": self.summary, "pending": self._summarizing + self._unsummarized, "history": self.history}
+
+    def restore(self, state):
+        """state() で保存した中身から続きを始める。要約待ちのターンがあれば要約し直す。"""
+        self.summary = state.get("summary", "")
+        self._unsummarized = list(state.get("pending", []))
+        self.history = list(state.get("history", []))
+        self._tokens = [estimate_tokens(turn["parts"][0]) for turn in self.history]
+        self._refresh_summary()
+
+    def rewind(self):
+        """直前の1往復を取り消す（Undo用）。"""
+        if len(self.history) >= 2:
+            del self.history[-2:]
+            del self._tokens[-2:]
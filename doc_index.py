@@ -0,0 +1,139 @@
+# === 📚 資料の分割と検索（BM25） ===
+# アップロードされた資料を小さな塊（チャンク）に分けて索引を作り、毎ターン関係のある部分だけをAIに渡す。
+# 索引は資料本文のハッシュをファイル名にしてディスクに保存し、同じ資料なら作り直さない。
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+_EN_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RUN_RE = re.compile("[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def estimate_tokens(text):
+    """トークン数のざっくり見積もり。英数字は4文字で1トークン、日本語は1文字1トークンとして数える。"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def truncate_to_tokens(text, token_budget):
+    """estimate_tokens() で token_budget に収まるところまで、先頭から切り詰める。"""
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += 0.25 if ord(ch) < 128 else 1
+        if used > token_budget:
+            return text[:i]
+    return text
+
+
+def tokenize(text):
+    # 英語は単語、日本語は分かち書きの代わりに2文字ずつ（bigram）に区切る
+    text = text.lower()
+    tokens = _EN_WORD_RE.findall(text)
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def chunk_text(text, max_chars=800, overlap=100):
+    """段落の区切りを優先しつつ、max_chars 文字程度のチャンクに分ける。"""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks, current = [], ""
+    for para in paragraphs:
+        while len(para) > max_chars:
+            # 1段落が長すぎる場合は、少し重ねながら切る
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:max_chars])
+            para = para[max_chars - overlap:]
+        if current and len(current) + len(para) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(tokenize(c)) for c in chunks]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if chunks else 0.0
+        doc_freq = Counter()
+        for tf in self._term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(chunks)
+        self._idf = {t: math.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in doc_freq.items()}
+
+    def search(self, query, k=5):
+        """(スコア, チャンク番号) をスコアの高い順に最大k件返す。"""
+        terms = set(tokenize(query))
+        scored = []
+        for i, tf in enumerate(self._term_freqs):
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / (self._avg_length or 1))
+            score = 0.0
+            for t in terms:
+                f = tf.get(t)
+                if f:
+                    score += self._idf[t] * f * (self.k1 + 1) / (f + norm)
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(reverse=True)
+        return scored[:k]
+
+    def select(self, query, token_budget, k=5):
+        """関係の深いチャンクを token_budget に収まるだけ選び、資料内の順番に並べて返す。"""
+        picked, used = [], 0
+        hits = self.search(query, k)
+        if not hits:
+            # 質問と重なる語が無い時は、資料の冒頭を使う
+            hits = [(0.0, i) for i in range(min(k, len(self.chunks)))]
+        for _, i in hits:
+            cost = estimate_tokens(self.chunks[i])
+            if used + cost > token_budget:
+                continue
+            picked.append(i)
+            used += cost
+        if not picked and hits:
+            # 日本語のチャンクは1つで数百トークンになるので、上限が小さいと1つも入らない。その時は一番の候補を切り詰めて渡す
+            return [truncate_to_tokens(self.chunks[hits[0][1]], token_budget)]
+        return [self.chunks[i] for i in sorted(picked)]
+
+    def to_dict(self):
+        return {"k1": self.k1, "b": self.b, "chunks": self.chunks}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["chunks"], k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+
+
+def load_or_build_index(doc_hash, load_text, index_dir):
+    """資料の索引をディスクから読み込む。無ければ load_text() で本文を取り出して作り、保存する。
+
+    本文が手に入らない（load_text() が None を返す）時は None を返す。
+    """
+    path = os.path.join(index_dir, f"{doc_hash}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return BM25Index.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        pass
+    doc_text = load_text()
+    if doc_text is None:
+        return None
+    index = BM25Index(chunk_text(doc_text))
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return index
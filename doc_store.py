@@ -0,0 +1,143 @@
+# === 📄 資料テキストの保存庫（PDFの文字抽出キャッシュ） ===
+# アップロードされたファイルの中身のハッシュをキーに、抽出したテキストをページごとにディスクへ保存する。
+# 同じファイルなら二度と解析しない。途中で再実行（ボタン操作など）に割り込まれても、続きのページから再開できる。
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+# これ以上のページ数のPDFは、並列オプションが有効ならプロセスを分けて抽出する
+PARALLEL_MIN_PAGES = 20
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _extract_page_range(data, start, end):
+    # 別プロセスで動くので、PDFはバイト列から開き直す
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return [(i, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+class DocStore:
+    def __init__(self, cache_dir, max_memory_docs=4, max_workers=None):
+        self.cache_dir = cache_dir
+        self.max_memory_docs = max_memory_docs
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._memory = OrderedDict()
+        self._complete = set()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _dir(self, doc_hash):
+        return os.path.join(self.cache_dir, doc_hash)
+
+    def _page_path(self, doc_hash, i):
+        return os.path.join(self._dir(doc_hash), f"page_{i:05d}.txt")
+
+    def _read_meta(self, doc_hash):
+        try:
+            with open(os.path.join(self._dir(doc_hash), "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, doc_hash, page_count):
+        os.makedirs(self._dir(doc_hash), exist_ok=True)
+        with open(os.path.join(self._dir(doc_hash), "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"page_count": page_count}, f)
+
+    def _write_page(self, doc_hash, i, text):
+        path = self._page_path(doc_hash, i)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _read_page(self, doc_hash, i):
+        try:
+            with open(self._page_path(doc_hash, i), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _remember(self, doc_hash, pages):
+        with self._lock:
+            self._memory[doc_hash] = pages
+            self._memory.move_to_end(doc_hash)
+            while len(self._memory) > self.max_memory_docs:
+                self._memory.popitem(last=False)
+
+    def has(self, doc_hash):
+        with self._lock:
+            if doc_hash in self._memory:
+                return True
+        return self._read_meta(doc_hash) is not None
+
+    def add_text(self, text):
+        doc_hash = file_hash(text.encode("utf-8"))
+        if not self.has(doc_hash):
+            self._write_meta(doc_hash, 1)
+            self._write_page(doc_hash, 0, text)
+        return doc_hash
+
+    def add_pdf(self, data, parallel=False):
+        """PDFを登録してハッシュを返す。未抽出のページだけを抽出する（一度抽出したページは読み直さない）。"""
+        doc_hash = file_hash(data)
+        with self._lock:
+            if doc_hash in self._complete:
+                return doc_hash
+        meta = self._read_meta(doc_hash)
+        if meta is None:
+            page_count = len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+            self._write_meta(doc_hash, page_count)
+        else:
+            page_count = meta["page_count"]
+
+        missing = [i for i in range(page_count) if not os.path.exists(self._page_path(doc_hash, i))]
+        if missing and parallel and len(missing) >= PARALLEL_MIN_PAGES and self.max_workers > 1:
+            step = -(-len(missing) // self.max_workers)
+            ranges = [(missing[j], missing[min(j + step, len(missing)) - 1] + 1) for j in range(0, len(missing), step)]
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=len(ranges), mp_context=ctx) as pool:
+                for results in pool.map(_extract_page_range, [data] * len(ranges), *zip(*ranges)):
+                    for i, text in results:
+                        self._write_page(doc_hash, i, text)
+        elif missing:
+            reader = PyPDF2.PdfReader(io.BytesIO(data))
+            for i in missing:
+                self._write_page(doc_hash, i, reader.pages[i].extract_text() or "")
+        with self._lock:
+            self._complete.add(doc_hash)
+        return doc_hash
+
+    def pages(self, doc_hash):
+        """ページごとのテキストのリスト。保存されていなければ None。"""
+        with self._lock:
+            pages = self._memory.get(doc_hash)
+            if pages is not None:
+                self._memory.move_to_end(doc_hash)
+                return pages
+        meta = self._read_meta(doc_hash)
+        if meta is None:
+            return None
+        pages = [self._read_page(doc_hash, i) for i in range(meta["page_count"])]
+        if any(p is None for p in pages):
+            return None
+        self._remember(doc_hash, pages)
+        return pages
+
+    def page_count(self, doc_hash):
+        meta = self._read_meta(doc_hash)
+        return meta["page_count"] if meta else 0
+
+    def text(self, doc_hash):
+        pages = self.pages(doc_hash)
+        return None if pages is None else "".join(p + "\n" for p in pages)
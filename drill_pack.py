@@ -0,0 +1,261 @@
+# === 🧩 ドリルパック（決まったシチュエーションの問題集を事前に作っておく） ===
+# 同じシチュエーション（入国審査・週末の予定など）を何度も練習する時のために、
+# 保存した設定ファイル（.json）から「質問の流れ」と、各質問の日本語訳・クイズ・ヒント・読み上げ音声をまとめて作り、
+# 1つのファイル（drill_packs/*.zip）に書き出す。
+#
+# アプリはパックを選ぶと、ボタン操作で送る決まった依頼（開始・もう一度・ギブアップ・練習完了）への返答を
+# パックから即座に返す。学習者が自分で答えた時など、パックに無い流れになった時だけ、いつも通りAIに聞く。
+#
+# 使い方（リポジトリの一番上で。APIキーは環境変数 GEMINI_API_KEY か .streamlit/secrets.toml から読む）:
+#   python drill_pack.py english_settings.json --trees 3 --depth 5
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import google.generativeai as genai
+
+from chat_manager import ChatManager
+from message_model import parse_response
+from model_router import FAST_MODEL
+from prompts import (
+    GIVEUP_PROMPT, PRACTICE_DONE_PROMPT, QUESTION_TOOLS, REPEAT_PROMPT, START_PROMPT, build_system_instruction,
+)
+from tts_cache import synthesize_mp3, tts_cache_key
+
+PACK_FORMAT = 1
+DRILL_PACK_DIR = "drill_packs"
+# この項目が今の設定と一致する時だけパックを使う（指示書の中身が同じになる）
+MATCH_FIELDS = ("level", "user_name", "questioner", "situation", "focus_words")
+DEFAULT_SETTINGS = {"level": "2: 初心者（日常会話の基礎）", "user_name": "Anata", "questioner": "同年代の気さくな友達",
+                    "situation": "週末の予定について話しています。", "focus_words": "", "tts_slow": False}
+
+# 決まった依頼 → 質問ごとに用意しておく返答の種類
+SCRIPTED_STEPS = {REPEAT_PROMPT: "repeat", GIVEUP_PROMPT: "giveup", PRACTICE_DONE_PROMPT: "next"}
+
+
+def pack_settings(settings):
+    merged = {**DEFAULT_SETTINGS, **{k: v for k, v in settings.items() if k in DEFAULT_SETTINGS}}
+    # サイドバーは名前が空なら "Anata" を使うので、パックの側も合わせる
+    merged["user_name"] = merged["user_name"] or "Anata"
+    return merged
+
+
+class DrillPack:
+    """読み込んだパック。質問文 → その質問への決まった依頼の返答・お助けツールの結果。"""
+
+    def __init__(self, manifest, audio=None):
+        if manifest.get("format") != PACK_FORMAT:
+            raise ValueError(f"unsupported drill pack format: {manifest.get('format')}")
+        self.manifest = manifest
+        self.settings = manifest["settings"]
+        self.version = manifest["version"]
+        self.openings = manifest["openings"]
+        self.nodes = manifest["nodes"]
+        self.audio = audio or {}    # 読み上げ音声のキー → MP3
+        # パックが質問を出した返答（開始・次の質問・もう一度）→ その質問文
+        asking = list(self.openings) + [node[step] for node in self.nodes.values() for step in ("repeat", "next") if node.get(step)]
+        self._asked_by = {text: parse_response(text).target for text in asking}
+
+    @classmethod
+    def load(cls, path):
+        with zipfile.ZipFile(path) as zf:
+            manifest = json.loads(zf.read("pack.json"))
+            audio = {os.path.splitext(os.path.basename(name))[0]: zf.read(name)
+                     for name in zf.namelist() if name.startswith("audio/")}
+        return cls(manifest, audio)
+
+    def matches(self, settings, has_doc=False):
+        # 資料つきの会話は、資料の抜粋を見ながら返答する必要があるので対象外
+        return not has_doc and all(self.settings.get(k) == pack_settings(settings).get(k) for k in MATCH_FIELDS)
+
+    def scripted_reply(self, prompt, current_question="", last_reply=""):
+        """決まった依頼への返答をパックから返す。パックに無い流れなら None（AIに聞く）。
+
+        last_reply は直前のAIの返答。それがパック自身の返答の時だけ、パックの続きを返す。
+        学習者が自分で答えるなど、その質問でAIとやり取りした後は、AI側の履歴がパックと食い違うので使わない。
+        """
+        if prompt == START_PROMPT:
+            return random.choice(self.openings) if self.openings else None
+        step = SCRIPTED_STEPS.get(prompt)
+        node = self.nodes.get(current_question)
+        if step is None or node is None:
+            return None
+        if step == "next":
+            # 次の質問は、パックのギブアップ解説（リピート練習）の後でだけ使える
+            return node.get("next") if last_reply == node.get("giveup") else None
+        # もう一度・ギブアップは、パックがその質問を出した直後だけ
+        return node.get(step) if self._asked_by.get(last_reply) == current_question else None
+
+    def tool_results(self, question):
+        return self.nodes.get(question, {}).get("tools", {})
+
+    def seed_tts(self, tts_cache):
+        for key, data in self.audio.items():
+            tts_cache.put(key, data)
+
+    def describe(self):
+        return f"質問 {len(self.nodes)} 個・音声 {len(self.audio)} 個（{self.manifest['created'][:10]} 作成 / v{self.version}）"
+
+
+def list_packs(pack_dir=DRILL_PACK_DIR):
+    try:
+        return sorted((name for name in os.listdir(pack_dir) if name.endswith(".zip")), reverse=True)
+    except OSError:
+        return []
+
+
+# === 🏗️ パックを作る（オフライン） ===
+def build_tree(settings, model_name, depth):
+    """1本の質問の流れ：開始 → （各質問で：もう一度／ギブアップ → 練習完了 → 次の質問）を depth 回。"""
+    system_instruction = build_system_instruction(
+        settings["questioner"], settings["user_name"], settings["level"], settings["situation"], settings["focus_words"])
+    manager = ChatManager(model_name, system_instruction)
+    try:
+        opening = reply = manager.send(START_PROMPT, kind="start")
+        nodes = {}
+        for _ in range(depth):
+            message = parse_response(reply)
+            if not message.is_question or message.target in nodes:
+                break
+            node = {
+                "repeat": manager.generate(manager.prepare(REPEAT_PROMPT)),
+                "giveup": manager.generate(manager.prepare(GIVEUP_PROMPT)),
+            }
+            manager.commit(GIVEUP_PROMPT, node["giveup"])
+            node["next"] = reply = manager.send(PRACTICE_DONE_PROMPT)
+            nodes[message.target] = node
+        return opening, nodes
+    finally:
+        manager.close()
+
+
+def spoken_texts(openings, nodes):
+    """パックの返答の中で、読み上げる英文（質問とリピート練習の文）。"""
+    texts = set()
+    replies = list(openings) + [reply for node in nodes.values() for reply in (node["repeat"], node["giveup"], node["next"])]
+    for reply in replies:
+        message = parse_response(reply)
+        if message.speak_text:
+            texts.add(message.speak_text)
+    return texts
+
+
+def _tool_text(model_name, prompt):
+    return genai.GenerativeModel(model_name).generate_content(prompt).text
+
+
+def build_pack(settings, model_name, trees=3, depth=5, tool_model=FAST_MODEL, max_workers=8, log=print):
+    settings = pack_settings(settings)
+    openings, nodes = [], {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 1) 質問の流れ（1本の中は順番に、本同士は並列に）
+        for future in as_completed([executor.submit(build_tree, settings, model_name, depth) for _ in range(trees)]):
+            try:
+                opening, tree_nodes = future.result()
+            except Exception as e:
+                log(f"skipped a tree: {e}")
+                continue
+            openings.append(opening)
+            for question, node in tree_nodes.items():
+                nodes.setdefault(question, node)
+        log(f"questions: {len(nodes)}")
+
+        # 2) お助けツールと読み上げ音声（すべて並列に）
+        tool_jobs = {executor.submit(_tool_text, tool_model, make_prompt(question)): (question, tool)
+                     for question in nodes for tool, make_prompt in QUESTION_TOOLS.items()}
+        tts_jobs = {executor.submit(synthesize_mp3, text, "en", settings["tts_slow"]): text
+                    for text in spoken_texts(openings, nodes)}
+        for future in as_completed(tool_jobs):
+            question, tool = tool_jobs[future]
+            try:
+                nodes[question].setdefault("tools", {})[tool] = future.result()
+            except Exception as e:
+                log(f"skipped {tool} for {question!r}: {e}")
+        audio = {}
+        for future in as_completed(tts_jobs):
+            try:
+                audio[tts_cache_key(tts_jobs[future], "en", settings["tts_slow"])] = future.result()
+            except Exception as e:
+                log(f"skipped audio for {tts_jobs[future]!r}: {e}")
+
+    content = json.dumps({"settings": settings, "openings": openings, "nodes": nodes}, ensure_ascii=False, sort_keys=True)
+    manifest = {
+        "format": PACK_FORMAT,
+        "version": hashlib.sha256(content.encode("utf-8")).hexdigest()[:12],
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "model": model_name,
+        "tool_model": tool_model,
+        "settings": settings,
+        "openings": openings,
+        "nodes": nodes,
+    }
+    return DrillPack(manifest, audio)
+
+
+def write_pack(pack, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("pack.json", json.dumps(pack.manifest, ensure_ascii=False, indent=2))
+        for key, data in pack.audio.items():
+            # MP3はこれ以上縮まないので、圧縮せずに入れる
+            zf.writestr(f"audio/{key}.mp3", data, compress_type=zipfile.ZIP_STORED)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
+
+
+def default_pack_path(pack):
+    settings_key = hashlib.sha256(json.dumps([pack.settings[k] for k in MATCH_FIELDS], ensure_ascii=False).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(DRILL_PACK_DIR, f"drill-{settings_key}-v{pack.version}.zip")
+
+
+def _api_key():
+    key = os.environ.get("GEMINI_API_KEY")
+    if key:
+        return key
+    import tomllib
+    try:
+        with open(os.path.join(".streamlit", "secrets.toml"), "rb") as f:
+            return tomllib.load(f).get("GEMINI_API_KEY")
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="設定ファイルからドリルパックを作る")
+    parser.add_argument("settings", help="サイドバーで保存した設定ファイル（english_settings.json）")
+    parser.add_argument("--trees", type=int, default=3, help="作る質問の流れの本数（開始の質問の種類）")
+    parser.add_argument("--depth", type=int, default=5, help="1本あたりの質問の数")
+    parser.add_argument("--model", default="gemini-2.5-flash", help="会話の返答を作るモデル")
+    parser.add_argument("--tool-model", default=FAST_MODEL, help="訳・クイズ・ヒントを作るモデル")
+    parser.add_argument("--workers", type=int, default=8, help="同時に呼び出す数")
+    parser.add_argument("-o", "--output", help="出力先（省略時は drill_packs/ の下に自動で名前をつける）")
+    args = parser.parse_args()
+
+    api_key = _api_key()
+    if not api_key:
+        sys.exit("GEMINI_API_KEY is not set (environment variable or .streamlit/secrets.toml)")
+    genai.configure(api_key=api_key.strip())
+    with open(args.settings, encoding="utf-8") as f:
+        settings = json.load(f)
+    if settings.get("doc_hash") or settings.get("doc_text"):
+        print("note: the document in the settings file is not used for drill packs", file=sys.stderr)
+
+    pack = build_pack(settings, args.model, args.trees, args.depth, args.tool_model, args.workers,
+                      log=lambda line: print(line, file=sys.stderr))
+    path = args.output or default_pack_path(pack)
+    write_pack(pack, path)
+    print(f"{path}: {pack.describe()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# === 🛠️ お助けツールの結果置き場と先読み ===
+# 結果は「質問文」ごとに保存するので、同じ質問が繰り返された時（パターンC）もそのまま使える。
+# 先読みはサーバー共通のスレッドプールで動かし、1セッションあたりの同時実行数と呼び出し回数に上限をつける。
+# 同時実行数の上限は投入する時点で守る（上限を超えた分はセッションごとの待ち行列に置き、1つ終わるごとに次を投入する）。
+# プールのスレッドが上限の空きを待って塞がり、他のセッションの先読みが進まなくなるのを避けるため。
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from prompts import QUESTION_TOOLS
+
+
+class ToolCache:
+    """1セッション分のお助けツールの結果。バックグラウンドのスレッドからも書き込まれる。"""
+
+    def __init__(self, max_questions=8, max_concurrency=2, max_prefetch_calls=60):
+        self.max_questions = max_questions
+        self.max_concurrency = max_concurrency
+        self.max_prefetch_calls = max_prefetch_calls
+        self.prefetch_calls = 0
+        self._results = OrderedDict()   # 質問文 → {ツール名: 結果}
+        self._pending = {}              # (質問文, ツール名) → Future（待ち行列にあるものも含む）
+        self._waiting = deque()         # 同時実行数の上限で、まだ投入していない先読み
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def put(self, question, tool, text):
+        with self._lock:
+            self._results.setdefault(question, {})[tool] = text
+            self._results.move_to_end(question)
+            while len(self._results) > self.max_questions:
+                self._results.popitem(last=False)
+
+    def get(self, question, tool, wait=True):
+        """保存済みの結果を返す。先読み中なら終わるのを待つ（wait=False なら待たずに None）。"""
+        with self._lock:
+            text = self._results.get(question, {}).get(tool)
+            future = self._pending.get((question, tool))
+        if text is not None or future is None or not wait:
+            return text
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def is_pending(self, question, tool):
+        with self._lock:
+            return (question, tool) in self._pending
+
+    def _start(self, executor, key, prompt, generate, future):
+        # self._lock を持った状態で呼ぶ
+        self._running += 1
+        executor.submit(self._run, executor, key, prompt, generate, future)
+
+    def _run(self, executor, key, prompt, generate, future):
+        question, tool = key
+        try:
+            text = generate(tool, prompt)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            self.put(question, tool, text)
+            future.set_result(text)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                self._running -= 1
+                if self._waiting:
+                    self._start(*self._waiting.popleft())
+
+    def prefetch(self, executor, question, generate, tools=None):
+        """まだ結果も先読みも無いツールを、呼び出し回数の上限まで executor に投入する（同時実行数を超える分は待ち行列へ）。
+
+        generate は (ツール名, プロンプト) を受け取って結果の文字列を返す関数。
+        """
+        for tool in tools or QUESTION_TOOLS:
+            key = (question, tool)
+            with self._lock:
+                if tool in self._results.get(question, {}) or key in self._pending:
+                    continue
+                if self.prefetch_calls >= self.max_prefetch_calls:
+                    return
+                self.prefetch_calls += 1
+                future = self._pending[key] = Future()
+                task = (executor, key, QUESTION_TOOLS[tool](question), generate, future)
+                if self._running < self.max_concurrency:
+                    self._start(*task)
+                else:
+                    self._waiting.append(task)
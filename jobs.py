@@ -0,0 +1,132 @@
+# === ⏳ 時間のかかるAI呼び出しをバックグラウンドで動かす ===
+# ボタンを押した時にその場でAPIを待つと、その間は画面全体が固まり、連打すると同じ依頼が何度も飛ぶ。
+# そこで呼び出しは「ジョブ」としてサーバー共通のスレッドプールに投げ、画面は st.fragment で定期的に様子を見る。
+#   ・レーンは2つ：評価のような重い処理（slow）と、辞書・訳・文字起こしのような軽い処理（fast）。
+#     重い処理が詰まっていても、軽い処理は待たされない。
+#   ・ジョブはセッションごとに「枠（slot）」単位で持つ。実行中に同じ枠へ同じキーで投げ直しても（連打）、新しい呼び出しはしない。
+#     take() で結果を受け取ったジョブは枠から外すので、受け取った後に同じ入力でわざと投げ直せば、もう一度呼び出す。
+#   ・会話をリセットしたら、そのセッションのジョブはすべて取り消す。
+# ジョブの関数はスレッドで動くので、st.* は使わないこと。
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+
+class JobRunner:
+    """サーバー全体で1つ。レーンごとのスレッドプール。"""
+
+    def __init__(self, fast_workers=4, slow_workers=4):
+        self._executors = {
+            "fast": ThreadPoolExecutor(max_workers=fast_workers, thread_name_prefix="job-fast"),
+            "slow": ThreadPoolExecutor(max_workers=slow_workers, thread_name_prefix="job-slow"),
+        }
+
+    def submit(self, lane, fn):
+        return self._executors[lane].submit(fn)
+
+
+class Job:
+    def __init__(self, slot, key, label, future):
+        self.slot = slot
+        self.key = key
+        self.label = label
+        self.future = future
+        self.started = time.time()
+        self.cancelled = False
+        self.notified = False   # 終わったことを画面に伝え済み
+
+    def done(self):
+        return self.future.done()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def error(self):
+        """失敗していれば例外、成功・実行中なら None。"""
+        if not self.done():
+            return None
+        try:
+            return self.future.exception()
+        except CancelledError as e:
+            return e
+
+    @property
+    def result(self):
+        return self.future.result() if self.done() and self.error is None else None
+
+
+class SessionJobs:
+    """1セッション分のジョブ（枠 → 最新のジョブ）。st.session_state に置く。"""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, slot, key, fn, lane="fast", label="", cached=None):
+        """枠にジョブを投げる。同じキーのジョブが実行中か、成功してまだ受け取っていなければ、それをそのまま返す（連打対策）。
+
+        別のキーで投げ直した時は、前のジョブを取り消して置き換える。
+        cached を渡すと fn は呼ばず、その値で終わったジョブにする（キャッシュ済みの結果を待たせずに出すため）。
+        """
+        with self._lock:
+            job = self._jobs.get(slot)
+            if job is not None and job.key == key and not job.cancelled and (not job.done() or job.error is None):
+                return job
+            if job is not None:
+                self._cancel(job)
+            if cached is None:
+                future = self.runner.submit(lane, fn)
+            else:
+                future = Future()
+                future.set_result(cached)
+            job = self._jobs[slot] = Job(slot, key, label or slot, future)
+            job.notified = cached is not None
+            return job
+
+    def get(self, slot, key=None):
+        """枠の最新のジョブ。key を渡すと、キーが一致する時だけ返す。"""
+        with self._lock:
+            job = self._jobs.get(slot)
+        if job is None or (key is not None and job.key != key):
+            return None
+        return job
+
+    def take(self, slot):
+        """終わったジョブを1回だけ受け取る（実行中・受け取り済みなら None）。受け取ったジョブは枠から外す。"""
+        with self._lock:
+            job = self._jobs.get(slot)
+            if job is None or not job.done():
+                return None
+            del self._jobs[slot]
+            return job
+
+    def pending(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done()]
+
+    def newly_finished(self):
+        """前回の確認から後に終わったジョブ（画面の再描画が必要なもの）。"""
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.done() and not job.notified]
+            for job in finished:
+                job.notified = True
+        return finished
+
+    def has_unnotified(self):
+        """終わったのに、まだ画面に伝えていないジョブがあるか。"""
+        with self._lock:
+            return any(job.done() and not job.notified for job in self._jobs.values())
+
+    def _cancel(self, job):
+        # 実行中のAPI呼び出し自体は止められないので、結果を使わないようにするだけ
+        job.cancelled = True
+        job.future.cancel()
+
+    def cancel_all(self):
+        with self._lock:
+            for job in self._jobs.values():
+                self._cancel(job)
+            self._jobs.clear()
@@ -0,0 +1,111 @@
+# === 📨 会話メッセージの構造化モデル ===
+# AIの返答は届いた時に1回だけ解析し、以降はこのレコードのフィールドを参照する。
+# 形式が崩れた返答（括弧が全角、**で囲まれている、マーカーが無い等）の扱いはここに集約する。
+import re
+from dataclasses import dataclass
+
+FEEDBACK = "フィードバック"
+QUESTION = "英語の質問"
+PRACTICE = "リピート練習"
+
+_MARKER_RE = re.compile(r"\**[\[［]\s*(フィードバック|英語の質問|リピート練習)\s*[\]］]\**")
+
+
+def clean_text_for_tts(text):
+    # Markdownの記号(*, _, #, ~)を完全に削除
+    text = re.sub(r'[*_#~]', '', text)
+    # 単語を囲むアポストロフィや引用符だけを削除（It's のような単語内のアポストロフィは残す）
+    text = re.sub(r"(?<!\w)['\"]|['\"](?!\w)", '', text)
+    return text.strip()
+
+
+@dataclass(slots=True)
+class ChatMessage:
+    role: str
+    content: str
+    pattern: str = ""            # "A"（リピート練習） / "B"（通常の質問） / "C"（質問の繰り返し） / ""（形式外）
+    feedback_lines: tuple = ()
+    target: str = ""             # [英語の質問] または [リピート練習] の英文
+    speak_text: str = ""         # 読み上げ用にクリーニングした target
+    hidden: bool = False         # 画面や記録に出さない、システム的なユーザー発話
+
+    @property
+    def is_practice(self):
+        return self.pattern == "A"
+
+    @property
+    def is_question(self):
+        return self.pattern in ("B", "C")
+
+    @property
+    def feedback(self):
+        return "\n".join(self.feedback_lines)
+
+    def to_log_text(self):
+        if not self.pattern:
+            return self.content.strip()
+        marker = PRACTICE if self.is_practice else QUESTION
+        parts = []
+        # 最初のマーカーより前の文章（「承知しました。」など）も記録に残す
+        preamble = split_sections(self.content)[""]
+        if preamble:
+            parts.append(preamble)
+        if self.feedback_lines:
+            parts.append(f"[{FEEDBACK}]\n{self.feedback}")
+        parts.append(f"[{marker}]\n{self.target}")
+        return "\n".join(parts)
+
+
+def split_sections(text):
+    """マーカーごとに本文を分ける。マーカーより前の文章は "" キーに入る。同じマーカーは最初のものを使う。"""
+    sections = {}
+    pieces = _MARKER_RE.split(text)
+    sections[""] = pieces[0].strip()
+    for name, body in zip(pieces[1::2], pieces[2::2]):
+        sections.setdefault(name, body.strip())
+    return sections
+
+
+def completed_target(partial_text):
+    """ストリーミング途中の本文から、言い終わった [英語の質問]/[リピート練習] の英文を返す。まだなら ""。
+
+    後ろに次のマーカーが来ていれば全体を、まだなら改行まで届いた行だけを返す
+    （複数行の英文の途中で、書きかけの行まで読み上げないように）。
+    """
+    pieces = _MARKER_RE.split(partial_text)
+    for i in range(1, len(pieces), 2):
+        if pieces[i] not in (QUESTION, PRACTICE):
+            continue
+        body = pieces[i + 1].lstrip()
+        if i + 2 < len(pieces):
+            return body.strip()
+        return body[:body.rfind("\n") + 1].strip()
+    return ""
+
+
+def parse_response(text, previous_question=""):
+    """AIの返答を ChatMessage にする。どんな文字列でも例外を出さない。"""
+    text = text or ""
+    sections = split_sections(text)
+    feedback = sections.get(FEEDBACK, "")
+    target, pattern = "", ""
+    if sections.get(PRACTICE):
+        target, pattern = sections[PRACTICE], "A"
+    elif sections.get(QUESTION):
+        target = sections[QUESTION]
+        pattern = "C" if previous_question and target == previous_question else "B"
+    if not pattern:
+        feedback = text.strip()
+    lines = tuple(line.strip() for line in feedback.splitlines() if line.strip())
+    return ChatMessage(
+        role="assistant",
+        content=text,
+        pattern=pattern,
+        feedback_lines=lines,
+        target=target,
+        speak_text=clean_text_for_tts(target) if target else "",
+    )
+
+
+def user_message(content):
+    return ChatMessage(role="user", content=content, hidden=content.startswith("（"))
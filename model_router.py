@@ -0,0 +1,131 @@
+# === 🧭 処理ごとのモデルの使い分けと、速いモデルへの自動切り替え ===
+# 文字起こし・ヒント・辞書などの軽い処理は最初から最速モデルに任せ、会話本体だけを選んだモデルで行う。
+# タイムアウト・回数制限（429）・遅すぎる返答が起きたら、そのモデルをしばらく避けて最速モデルに切り替える。
+# 会話本体が遅い時（p95が閾値超え）は、少し待っても返ってこなければ最速モデルにも同じ依頼を出し、先に返った方を使う。
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+FAST_MODEL = "gemini-2.5-flash-lite"
+
+# 呼び出し場所の一覧（画面表示用の名前つき）。"main" は選んだモデル、"fast" は最速モデル
+SITES = {
+    "start": ("会話の開始", "main"),
+    "chat": ("会話の返答", "main"),
+    "evaluation": ("最後の評価", "main"),
+    "transcribe": ("文字起こし", "fast"),
+    "judge": ("発音の判定", "fast"),
+    "quiz": ("リスニングクイズ", "fast"),
+    "hint": ("ヒント", "fast"),
+    "translation": ("日本語訳", "fast"),
+    "dictionary": ("単語辞書", "fast"),
+    "jp_to_en": ("お助け英訳", "fast"),
+    "history_summary": ("履歴の要約", "fast"),
+}
+DEFAULT_FAST_SITES = [site for site, (_, tier) in SITES.items() if tier == "fast"]
+
+# これより遅かったら「遅すぎる」とみなして、そのモデルをしばらく避ける（秒）
+SLO_SECONDS = {"start": 15.0, "chat": 15.0, "evaluation": 30.0}
+DEFAULT_SLO_SECONDS = 8.0
+
+_RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "DeadlineExceeded", "ServiceUnavailable", "TimeoutError", "Timeout", "ReadTimeout"}
+
+
+def is_retryable(exc):
+    """タイムアウト・回数制限・一時的なサーバーエラーなら True（別のモデルで試す価値がある）。"""
+    if type(exc).__name__ in _RETRYABLE_ERRORS:
+        return True
+    code = getattr(exc, "code", None)
+    return code in (429, 503, 504)
+
+
+class ModelRouter:
+    """サーバー全体で1つ。モデルごとの「しばらく避ける」状態を、全セッションで共有する。"""
+
+    def __init__(self, fast_model=FAST_MODEL, timeout_seconds=30.0, cooldown_seconds=120.0,
+                 hedge_p95_ms=8000.0, hedge_delay_seconds=2.0, max_workers=8):
+        self.fast_model = fast_model
+        self.timeout_seconds = timeout_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_p95_ms = hedge_p95_ms
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self._avoid_until = {}      # モデル名 → この時刻までは避ける
+        self._stats = {"fallbacks": 0, "hedged": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def report_failure(self, model_name):
+        """このモデルをしばらく避ける（最速モデル自身は避けようがないので何もしない）。"""
+        if model_name == self.fast_model:
+            return
+        with self._lock:
+            self._avoid_until[model_name] = time.time() + self.cooldown_seconds
+
+    def report_latency(self, site, model_name, seconds):
+        if seconds > SLO_SECONDS.get(site, DEFAULT_SLO_SECONDS):
+            self.report_failure(model_name)
+
+    def is_degraded(self, model_name):
+        with self._lock:
+            return self._avoid_until.get(model_name, 0) > time.time()
+
+    def model_for(self, site, main_model, fast_sites=DEFAULT_FAST_SITES):
+        if site in fast_sites or self.is_degraded(main_model):
+            return self.fast_model
+        return main_model
+
+    def _timed_call(self, site, model_name, fn):
+        start = time.perf_counter()
+        result = fn(model_name, self.timeout_seconds)
+        self.report_latency(site, model_name, time.perf_counter() - start)
+        return result
+
+    def call(self, site, main_model, fn, fast_sites=DEFAULT_FAST_SITES):
+        """fn(モデル名, タイムアウト秒) を呼ぶ。一時的なエラーなら最速モデルでもう1回だけ試す。"""
+        model_name = self.model_for(site, main_model, fast_sites)
+        try:
+            return self._timed_call(site, model_name, fn)
+        except Exception as e:
+            if model_name == self.fast_model or not is_retryable(e):
+                raise
+            self.report_failure(model_name)
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            return self._timed_call(site, self.fast_model, fn)
+
+    def should_hedge(self, p95_ms):
+        return p95_ms > self.hedge_p95_ms
+
+    def call_hedged(self, site, main_model, fn, fast_sites=DEFAULT_FAST_SITES):
+        """最初のモデルが hedge_delay_seconds 以内に返らなければ、最速モデルにも同じ依頼を出して早い方を返す。"""
+        model_name = self.model_for(site, main_model, fast_sites)
+        if model_name == self.fast_model:
+            return self.call(site, main_model, fn, fast_sites)
+        primary = self._executor.submit(self._timed_call, site, model_name, fn)
+        done, _ = wait([primary], timeout=self.hedge_delay_seconds)
+        if done and primary.exception() is None:
+            return primary.result()
+        with self._lock:
+            self._stats["hedged"] += 1
+        backup = self._executor.submit(self._timed_call, site, self.fast_model, fn)
+        pending = {primary, backup}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        with self._lock:
+                            self._stats["hedge_wins"] += 1
+                    return future.result()
+                first_error = first_error or future.exception()
+                if future is primary and is_retryable(future.exception()):
+                    self.report_failure(model_name)
+        raise first_error
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            now = time.time()
+            stats["degraded"] = [m for m, until in self._avoid_until.items() if until > now]
+        return stats
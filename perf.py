@@ -0,0 +1,137 @@
+# === ⏱️ 処理時間とコストの記録 ===
+# AI呼び出し・読み上げ音声の生成ごとに、かかった時間・トークン数・送信した音声のバイト数・キャッシュヒットを記録する。
+# 記録はセッションごとに直近の分だけメモリに持ち、同時にサーバー全体で1つのJSONLファイルへ追記していく。
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(values, q):
+    """values の q パーセンタイル（線形補間）。空なら 0。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+def usage_tokens(response):
+    """Geminiの返答から (入力トークン数, 出力トークン数) を取り出す。取れなければ (0, 0)。"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+
+class PerfLog:
+    """追記専用のJSONLファイル。サーバー全体で1つを共有する。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+
+
+class PerfEvent:
+    """track() の中で、返答を受け取った後にトークン数やキャッシュヒットを書き込むための入れ物。"""
+
+    def __init__(self, model="", upload_bytes=0):
+        self.model = model
+        self.upload_bytes = upload_bytes
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.cache_hit = False
+
+    def set_usage(self, response):
+        self.prompt_tokens, self.response_tokens = usage_tokens(response)
+
+
+class PerfRecorder:
+    """1セッション分の記録。バックグラウンドのスレッドからも書き込まれる。"""
+
+    def __init__(self, session_id, log=None, max_records=1000):
+        self.session_id = session_id
+        self.log = log
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds, model="", prompt_tokens=0, response_tokens=0, upload_bytes=0, cache_hit=False, ok=True,
+               original_bytes=0):
+        record = {
+            "ts": round(time.time(), 3),
+            "session": self.session_id,
+            "kind": kind,
+            "model": model,
+            "ms": round(seconds * 1000, 1),
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "upload_bytes": upload_bytes,
+            "original_bytes": original_bytes,   # 録音の下ごしらえ（audio_prep）の前の大きさ。それ以外は 0
+            "cache_hit": cache_hit,
+            "ok": ok,
+        }
+        with self._lock:
+            self._records.append(record)
+        if self.log is not None:
+            self.log.write(record)
+
+    @contextmanager
+    def track(self, kind, model="", upload_bytes=0):
+        event = PerfEvent(model, upload_bytes)
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield event
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.record(
+                kind, time.perf_counter() - start, model=event.model,
+                prompt_tokens=event.prompt_tokens, response_tokens=event.response_tokens,
+                upload_bytes=event.upload_bytes, cache_hit=event.cache_hit, ok=ok,
+            )
+
+    def records(self, kind=None):
+        with self._lock:
+            return [r for r in self._records if kind is None or r["kind"] == kind]
+
+    def latency_percentile(self, kind, q, model=None):
+        values = [r["ms"] for r in self.records(kind) if not r["cache_hit"] and (model is None or r["model"] == model)]
+        return percentile(values, q)
+
+    def summary(self):
+        """種類×モデルごとの集計（表示用）。"""
+        groups = {}
+        for r in self.records():
+            groups.setdefault((r["kind"], r["model"]), []).append(r)
+        rows = []
+        for (kind, model), items in sorted(groups.items()):
+            ms = [r["ms"] for r in items]
+            rows.append({
+                "種類": kind,
+                "モデル": model or "-",
+                "回数": len(items),
+                "p50 (ms)": round(percentile(ms, 50)),
+                "p95 (ms)": round(percentile(ms, 95)),
+                "入力トークン": sum(r["prompt_tokens"] for r in items),
+                "出力トークン": sum(r["response_tokens"] for r in items),
+                "送信バイト": sum(r["upload_bytes"] for r in items),
+                "キャッシュ率": f"{sum(r['cache_hit'] for r in items) / len(items):.0%}",
+                "失敗": sum(not r["ok"] for r in items),
+            })
+        return rows
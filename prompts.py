@@ -0,0 +1,109 @@
+# === 📝 プロンプトの文面 ===
+# 画面からのクリック、バックグラウンドの先読み、ドリルパックの事前生成（drill_pack.py）のすべてで同じ文面を使う。
+
+
+def build_system_instruction(questioner, user_name, level, situation, focus_words, has_doc=False):
+    """AIへの絶対的な指示書。"""
+    return f"""
+あなたは英会話のロールプレイング相手です。
+【相手の役柄】: {questioner}
+【ユーザーの名前】: {user_name}
+【レベル】: {level}
+【状況】: {situation}
+【重点テーマ】: {focus_words}
+【資料】: {"ユーザーの発言の前に【参考資料（抜粋）】が付いている場合は、その内容を会話の題材にしてください。" if has_doc else "なし"}
+
+【絶対に守るべき厳格なルール】
+1. あなたの出力は、以下の「指定フォーマット」のブロックのみで構成してください。
+2. 「はい、承知しました」などの会話のシステム的な前置きは絶対に出力しないでください。
+3. 英文中で単語を強調する際は、アポストロフィ（' '）やダブルクォーテーション（" "）を使わず、必ずMarkdownの太字（**単語**）を使用してください。
+4. 【重要】指定フォーマット内の括弧（ ）は説明書きです。出力する際は括弧そのものを削除し、中身のテキストだけを出力してください。
+
+【指定フォーマット】※以下のA・B・Cのいずれかのパターンのみを出力すること。
+
+▼ パターンA：ユーザーの英語にミス・不自然さがある場合（リピート練習）
+[フィードバック]
+- （日本語でのミスの指摘と解説）
+- 和訳: （すぐ下の[リピート練習]の英文の日本語訳）
+[リピート練習]
+（ユーザーが復唱するための、正しい英語のセリフのみ。記号は使わない）
+
+▼ パターンB：ユーザーの英語が自然、または会話の開始時（通常進行）
+[フィードバック]
+- （日本語で短く褒める、または相槌）
+[英語の質問]
+（役柄としてユーザーに投げかける英語のセリフや質問文のみ）
+
+▼ パターンC：ユーザーから「今の質問をもう一度言って」と頼まれた場合（やり直し）
+[フィードバック]
+- （日本語で「もう一度言いますね」と短く返事）
+[英語の質問]
+（直前と全く同じ英語の質問文）
+"""
+
+
+# ボタン操作で送る決まった依頼（ドリルパックはこの文面ごとに返答を用意しておく）
+START_PROMPT = "シチュエーションを開始して、最初の質問を英語でしてください。"
+REPEAT_PROMPT = "すみません、あなたの今の質問にもう一度別の言い方で答えたいので、全く同じ質問文をもう一度言ってください。新しい質問はしないでください。"
+PRACTICE_DONE_PROMPT = "（リピート練習完了。会話を続けるための新しい質問を【パターンB】の形式でしてください。）"
+GIVEUP_PROMPT = """
+今の質問の意図がわかりません。通信量削減のため、無駄な前置きは一切省き、以下の構成で極めて簡潔に出力してください。今回は【新しい質問は行わず】、私がそのまま復唱できる回答例を提示してください。
+
+[フィードバック]
+- 直前の質問の英語と日本語訳
+- 質問の意図（1文で）
+- この状況での自然な回答例の解説と、【★重要：その回答例の日本語訳】（絶対にここに書いてください）
+
+[リピート練習]
+（私がそのまま復唱して答えるための、英語の回答例のセリフのみ。複数の場合は一番標準的なものを1つだけ。絶対に新しい質問はしないこと）
+"""
+
+HINT_TYPES = ["使うべき単語を3つ", "文の出だし（3語）", "日本語でのアイデア"]
+
+
+def quiz_prompt(question):
+    return f"""
+    以下の英語セリフに対するリスニング3択クイズを作成してください。
+    【厳守事項】
+    ・「はい、作成します」などの前置きや、解説は【絶対】に出力しないこと。
+    ・問題文と選択肢は1文で極力短くシンプルにすること。
+    ・選択肢と正解の間に、必ず「---」という区切り線を入れてください。
+
+    セリフ: {question}
+
+    【出力フォーマット】
+    Q. （短い問題文）
+    1. （短い選択肢）
+    2. （短い選択肢）
+    3. （短い選択肢）
+    ---
+    正解: （番号のみ）
+    """
+
+
+def translation_prompt(question):
+    return f"以下を日本語に翻訳して:\n{question}"
+
+
+def hint_prompt(hint_type, question):
+    if hint_type == "使うべき単語を3つ":
+        return f"以下の質問に答えるために役立つ英単語（または熟語）を3つだけ、日本語の意味を添えて箇条書きで教えてください。英語の正解は絶対に書かないでください。\n質問: {question}"
+    if hint_type == "文の出だし（3語）":
+        return f"以下の質問に答えるための、自然な英文の書き出し（最初の3〜5語のみ）を1パターンだけ教えてください。日本語訳や解説、文の続きは書かないでください。\n質問: {question}"
+    return f"以下の質問に対して、どのような内容を答えればよいか、日本語で簡潔に2つのアイデア（方向性）を提案してください。英語の解答例は書かないでください。\n質問: {question}"
+
+
+def jp_to_en_prompt(jp_text):
+    return f"以下の日本語を、英会話のセリフとして自然な英語に翻訳してください。出力は英語のセリフのみとし、解説や前置きは一切不要です。\n\n日本語: {jp_text}"
+
+
+def dictionary_prompt(word):
+    return f"「{word}」の意味と簡単な例文を1つ教えて。簡潔に。"
+
+
+# 質問文だけで結果が決まるツール（先読みの対象）。ツール名 → プロンプトを作る関数
+QUESTION_TOOLS = {
+    "quiz": quiz_prompt,
+    "translation": translation_prompt,
+    **{f"hint:{t}": (lambda q, t=t: hint_prompt(t, q)) for t in HINT_TYPES},
+}
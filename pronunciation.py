@@ -0,0 +1,80 @@
+# === 🎯 リピート練習の発音判定 ===
+# 録音とお手本を1回のリクエストで送り、文字起こし・一致判定・一言アドバイスをまとめてJSONで受け取る。
+# お手本との単語単位の比較（どこが違うかの色付け）はAIを使わずにローカルで行う。
+import difflib
+import json
+import re
+from dataclasses import dataclass
+
+from message_model import clean_text_for_tts
+
+_WORD_RE = re.compile(r"[A-Za-z0-9]+(?:'[A-Za-z]+)?")
+
+
+@dataclass(slots=True)
+class JudgeResult:
+    transcript: str
+    match: bool
+    correction: str
+
+
+def build_judge_prompt(target):
+    return f"""
+添付の音声は、英語学習者が次のお手本を復唱したものです。
+お手本: {target}
+
+音声を聞こえた通りに英語で文字起こしし（お手本に寄せて補正しないこと）、お手本と一言一句同じか厳格に判定してください。
+出力は次のJSONのみとし、前置きや解説は一切不要です。
+{{"transcript": "文字起こしした英文", "match": true または false, "correction": "違いがあれば日本語で1文の指摘。同じなら空文字"}}
+"""
+
+
+def parse_judge_result(text):
+    """AIのJSON返答を JudgeResult にする。コードブロックや前後の文章が混ざっていても読む。"""
+    text = (text or "").strip()
+    found = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        data = json.loads(found.group(0) if found else text)
+    except (ValueError, TypeError):
+        data = None
+    if not isinstance(data, dict):
+        # JSONのオブジェクトになっていなければ（"123" や "[1]" なども）、返答全体を文字起こしとして扱う
+        return JudgeResult(transcript=text, match=False, correction="")
+    match = data.get("match", False)
+    if isinstance(match, str):
+        match = match.strip().lower() in ("true", "yes", "1")
+    return JudgeResult(
+        transcript=str(data.get("transcript", "")).strip(),
+        match=bool(match),
+        correction=str(data.get("correction", "")).strip(),
+    )
+
+
+def words(text):
+    return _WORD_RE.findall(clean_text_for_tts(text))
+
+
+def is_exact_match(transcript, target):
+    return [w.lower() for w in words(transcript)] == [w.lower() for w in words(target)]
+
+
+def word_diff(transcript, target):
+    """お手本と発音を単語単位で並べる。("ok" | "missing" | "extra", 単語) のリストを返す。
+
+    missing はお手本にあるのに言えなかった単語、extra はお手本に無いのに言った単語。
+    """
+    spoken, expected = words(transcript), words(target)
+    matcher = difflib.SequenceMatcher(a=[w.lower() for w in expected], b=[w.lower() for w in spoken], autojunk=False)
+    result = []
+    for op, a1, a2, b1, b2 in matcher.get_opcodes():
+        if op == "equal":
+            result.extend(("ok", w) for w in expected[a1:a2])
+            continue
+        result.extend(("missing", w) for w in expected[a1:a2])
+        result.extend(("extra", w) for w in spoken[b1:b2])
+    return result
+
+
+def diff_markdown(diff):
+    styles = {"ok": "{}", "missing": ":red[**{}**]", "extra": ":orange[~~{}~~]"}
+    return " ".join(styles[op].format(word) for op, word in diff)
@@ -0,0 +1,78 @@
+# === 🗃️ AI返答の共有キャッシュ（辞書・翻訳・クイズなど） ===
+# 入力だけで結果が決まるお助けツールの返答を、セッションをまたいでSQLiteに保存する。
+# キーは「モデル名＋正規化したプロンプト」のハッシュ。期限切れと件数上限で古いものから消す。
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+def normalize_prompt(prompt):
+    # 全角/半角のゆれと空白の違いだけを吸収する（意味が変わる正規化はしない）
+    text = unicodedata.normalize("NFKC", prompt)
+    return " ".join(text.split())
+
+
+def cache_key(model_name, prompt):
+    raw = f"{model_name}\n{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_entries=5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Streamlitのセッションは別スレッドで動くので、1つの接続をロックで守って共有する
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+
+    def get(self, model_name, prompt):
+        key = cache_key(model_name, prompt)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._stats["hits"] += 1
+            return row[0]
+
+    def put(self, model_name, prompt, response):
+        if not response:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (cache_key(model_name, prompt), model_name, response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                # 最後に使われたのが古いものから消す
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
@@ -0,0 +1,238 @@
+# === 💾 会話の保存と再開 ===
+# 会話は1ターンごとにSQLiteへ追記し、メモリ（st.session_state）には直近の分だけを置く。
+# ブラウザの再読み込みやサーバーの再起動の後も、会話ID（URLの ?sid=...）で続きから再開できる。
+# 設定・学習記録・AIに渡す履歴（要約つき）は、会話ごとに1行のスナップショットとして上書き保存する。
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from message_model import ChatMessage, clean_text_for_tts
+
+
+def _to_row(message):
+    return (message.role, message.content, message.pattern,
+            "\n".join(message.feedback_lines), message.target, int(message.hidden), time.time())
+
+
+def _from_row(row):
+    role, content, pattern, feedback, target, hidden = row
+    return ChatMessage(
+        role=role,
+        content=content,
+        pattern=pattern,
+        feedback_lines=tuple(feedback.splitlines()) if feedback else (),
+        target=target,
+        speak_text=clean_text_for_tts(target) if target else "",
+        hidden=bool(hidden),
+    )
+
+
+_MESSAGE_COLUMNS = "role, content, pattern, feedback, target, hidden"
+
+
+class SessionStore:
+    """サーバー全体で1つ。会話のメッセージ（追記のみ）と、会話ごとのスナップショット。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Streamlitのセッションは別スレッドで動くので、1つの接続をロックで守って共有する
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "id TEXT PRIMARY KEY, created REAL, updated REAL, settings TEXT, stats TEXT, manager TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "conversation_id TEXT, seq INTEGER, role TEXT, content TEXT, pattern TEXT, feedback TEXT, "
+                "target TEXT, hidden INTEGER, created REAL, PRIMARY KEY (conversation_id, seq))"
+            )
+
+    def create(self, conversation_id, settings):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (id, created, updated, settings, stats, manager) VALUES (?, ?, ?, ?, '{}', '{}')",
+                (conversation_id, now, now, json.dumps(settings, ensure_ascii=False)),
+            )
+
+    def load(self, conversation_id):
+        """スナップショット（settings / stats / manager の辞書）。無ければ None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT settings, stats, manager FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"settings": json.loads(row[0]), "stats": json.loads(row[1]), "manager": json.loads(row[2])}
+
+    def save_snapshot(self, conversation_id, settings, stats, manager):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE conversations SET updated = ?, settings = ?, stats = ?, manager = ? WHERE id = ?",
+                (time.time(), json.dumps(settings, ensure_ascii=False), json.dumps(stats),
+                 json.dumps(manager, ensure_ascii=False), conversation_id),
+            )
+
+    def append(self, conversation_id, message):
+        """会話の末尾に追記して、振った seq を返す。
+
+        seq はディスク上の最後の番号の次を1つの文で振るので、同じ会話を別のタブ・端末で開いていても上書きし合わない。
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO messages SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ?, ?, ?, ?, ?, ? FROM messages WHERE conversation_id = ?",
+                (conversation_id, *_to_row(message), conversation_id),
+            )
+            return self._conn.execute("SELECT seq FROM messages WHERE rowid = ?", (cursor.lastrowid,)).fetchone()[0]
+
+    def delete_from(self, conversation_id, seq):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ? AND seq >= ?", (conversation_id, seq))
+
+    def count(self, conversation_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+
+    def messages(self, conversation_id, start, end):
+        """seq が start 以上 end 未満のメッセージを [(seq, ChatMessage)] で返す。"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, {_MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (conversation_id, start, end),
+            ).fetchall()
+        return [(row[0], _from_row(row[1:])) for row in rows]
+
+    def visible_count(self, conversation_id, before_seq):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ? AND seq < ? AND hidden = 0", (conversation_id, before_seq)
+            ).fetchone()[0]
+
+    def visible_page(self, conversation_id, before_seq, offset, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, {_MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? AND seq < ? AND hidden = 0 "
+                "ORDER BY seq LIMIT ? OFFSET ?",
+                (conversation_id, before_seq, limit, offset),
+            ).fetchall()
+        return [(row[0], _from_row(row[1:])) for row in rows]
+
+    def last_question(self, conversation_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT target FROM messages WHERE conversation_id = ? AND pattern IN ('B', 'C') ORDER BY seq DESC LIMIT 1",
+                (conversation_id,),
+            ).fetchone()
+        return row[0] if row else ""
+
+    def export_log(self, conversation_id):
+        """会話記録（.txt）の中身。ダウンロードボタンが押された時にだけ、ディスクから1行ずつ読んで作る。"""
+        parts = ["【今日の英会話記録】\n\n"]
+        # 読み出し中も他のセッションが書き込めるよう、専用の接続で読む（WALなので書き込みを止めない）
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            rows = conn.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? AND hidden = 0 ORDER BY seq", (conversation_id,)
+            )
+            for row in rows:
+                message = _from_row(row)
+                sender = "あなた" if message.role == "user" else "AI"
+                parts.append(f"{sender}:\n{message.to_log_text()}\n\n{'='*40}\n\n")
+        finally:
+            conn.close()
+        return "".join(parts)
+
+
+class ConversationLog:
+    """1つの会話のメッセージ。ディスクに全部、メモリには直近 keep_recent 件だけを持つ。
+
+    seq（0から始まる通し番号）で読み書きする。st.session_state.messages に置く。
+    """
+
+    def __init__(self, store, conversation_id, keep_recent=30):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.keep_recent = keep_recent
+        self._reload()
+
+    def _reload(self):
+        self._length = self.store.count(self.conversation_id)
+        start = max(0, self._length - self.keep_recent)
+        self._recent = deque(message for _, message in self.store.messages(self.conversation_id, start, self._length))
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def first_in_memory(self):
+        return self._length - len(self._recent)
+
+    def __getitem__(self, seq):
+        if seq < 0:
+            seq += self._length
+        if not 0 <= seq < self._length:
+            raise IndexError(seq)
+        if seq >= self.first_in_memory:
+            return self._recent[seq - self.first_in_memory]
+        return self.store.messages(self.conversation_id, seq, seq + 1)[0][1]
+
+    def append(self, message):
+        seq = self.store.append(self.conversation_id, message)
+        if seq != self._length:
+            # 別のタブ・端末も同じ会話に書き込んでいた。そちらの発言も含めて、ディスクの並びに合わせ直す
+            self._reload()
+            return
+        self._recent.append(message)
+        self._length += 1
+        while len(self._recent) > self.keep_recent:
+            self._recent.popleft()
+
+    def drop_last(self, n):
+        """最後の n 件を消す（Undo用）。"""
+        if self.store.count(self.conversation_id) != self._length:
+            # 別のタブ・端末が後から追記していたら、その分を消さないよう先に合わせ直す
+            self._reload()
+        n = min(n, self._length)
+        self._length -= n
+        self.store.delete_from(self.conversation_id, self._length)
+        for _ in range(min(n, len(self._recent))):
+            self._recent.pop()
+        if len(self._recent) < self.keep_recent and self.first_in_memory > 0:
+            # 消した分だけ、ディスクからメモリへ戻す
+            start = max(0, self._length - self.keep_recent)
+            self._recent.extendleft(m for _, m in reversed(self.store.messages(self.conversation_id, start, self.first_in_memory)))
+
+    def visible_count(self, before_seq):
+        return self.store.visible_count(self.conversation_id, before_seq)
+
+    def visible_page(self, before_seq, offset, limit):
+        return self.store.visible_page(self.conversation_id, before_seq, offset, limit)
+
+    def last_question(self):
+        for message in reversed(self._recent):
+            if message.is_question:
+                return message.target
+        return self.store.last_question(self.conversation_id) if self.first_in_memory > 0 else ""
+
+    def recent_visible(self, n):
+        """画面に出す直近 n 件を [(seq, ChatMessage)] で返す。"""
+        found = []
+        start = self.first_in_memory
+        for offset in range(len(self._recent) - 1, -1, -1):
+            message = self._recent[offset]
+            if not message.hidden:
+                found.append((start + offset, message))
+                if len(found) == n:
+                    break
+        if len(found) < n and start > 0:
+            missing = n - len(found)
+            offset = max(0, self.visible_count(start) - missing)
+            found.extend(reversed(self.visible_page(start, offset, missing)))
+        return found[::-1]
@@ -0,0 +1,5 @@
+# リポジトリの一番上のモジュール（message_model.py など）を、どこから pytest を実行しても読み込めるようにする
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from drill_pack import PACK_FORMAT, DrillPack
+from prompts import GIVEUP_PROMPT, PRACTICE_DONE_PROMPT, REPEAT_PROMPT, START_PROMPT
+
+QUESTION = "What are you doing this weekend?"
+OPENING = "[英語の質問]\nWhat are you doing this weekend?"
+REPEAT = "[英語の質問]\nWhat are you doing this weekend?"
+GIVEUP = "[フィードバック]\n- 予定を答えましょう。\n[リピート練習]\nI'm going to the park."
+NEXT = "[英語の質問]\nWho are you going with?"
+
+
+@pytest.fixture
+def pack():
+    manifest = {
+        "format": PACK_FORMAT, "settings": {}, "version": "test", "created": "2026-01-01", "openings": [OPENING],
+        "nodes": {QUESTION: {"repeat": REPEAT, "giveup": GIVEUP, "next": NEXT}},
+    }
+    return DrillPack(manifest)
+
+
+def test_scripted_flow_follows_the_pack(pack):
+    assert pack.scripted_reply(START_PROMPT) == OPENING
+    assert pack.scripted_reply(REPEAT_PROMPT, QUESTION, OPENING) == REPEAT
+    assert pack.scripted_reply(GIVEUP_PROMPT, QUESTION, REPEAT) == GIVEUP
+    assert pack.scripted_reply(PRACTICE_DONE_PROMPT, QUESTION, GIVEUP) == NEXT
+
+
+def test_next_only_after_the_packs_own_giveup(pack):
+    # 自分で答えてAIがリピート練習を出した後の「練習完了」は、AIに聞く
+    live_practice = "[フィードバック]\n- 惜しい！\n[リピート練習]\nI'm going shopping."
+    assert pack.scripted_reply(PRACTICE_DONE_PROMPT, QUESTION, live_practice) is None
+    assert pack.scripted_reply(PRACTICE_DONE_PROMPT, QUESTION, OPENING) is None
+
+
+def test_live_turn_on_the_question_is_off_script(pack):
+    # AIが同じ質問を聞き返した後（パックの返答ではない）は、もう一度・ギブアップもAIに聞く
+    live_reply = "[フィードバック]\n- 英語で答えてみましょう。\n[英語の質問]\nWhat are you doing this weekend?"
+    assert pack.scripted_reply(REPEAT_PROMPT, QUESTION, live_reply) is None
+    assert pack.scripted_reply(GIVEUP_PROMPT, QUESTION, live_reply) is None
+    assert pack.scripted_reply("I'm going to the park.", QUESTION, OPENING) is None
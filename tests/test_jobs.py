@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from jobs import JobRunner, SessionJobs
+
+
+@pytest.fixture
+def jobs():
+    return SessionJobs(JobRunner(fast_workers=2, slow_workers=1))
+
+
+class Work:
+    """呼ばれた回数を数え、release() されるまで終わらない関数。"""
+
+    def __init__(self, result="ok", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self._go = threading.Event()
+
+    def release(self):
+        self._go.set()
+
+    def __call__(self):
+        self.calls += 1
+        self._go.wait(5)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def finish(job, work):
+    work.release()
+    job.future.exception(timeout=5)
+
+
+def test_same_key_while_running_is_not_resubmitted(jobs):
+    work = Work()
+    first = jobs.submit("transcribe", "k", work)
+    assert jobs.submit("transcribe", "k", work) is first
+    finish(first, work)
+    assert work.calls == 1
+
+
+def test_take_once_then_same_key_runs_again(jobs):
+    work = Work("hello")
+    finish(jobs.submit("transcribe", "k", work), work)
+    assert jobs.take("transcribe").result == "hello"
+    assert jobs.take("transcribe") is None
+    # 受け取った後に同じ録音でわざと送り直したら、もう一度呼び出す
+    again = jobs.submit("transcribe", "k", work)
+    finish(again, work)
+    assert jobs.take("transcribe") is again
+    assert work.calls == 2
+
+
+def test_take_while_running_returns_none(jobs):
+    work = Work()
+    job = jobs.submit("evaluation", "k", work, lane="slow")
+    assert jobs.take("evaluation") is None
+    finish(job, work)
+    assert jobs.take("evaluation") is job
+
+
+def test_failed_job_is_retried_with_same_key(jobs):
+    failing = Work(error=TimeoutError("slow"))
+    job = jobs.submit("evaluation", "k", failing, lane="slow")
+    finish(job, failing)
+    assert isinstance(job.error, TimeoutError)
+    assert job.result is None
+    assert jobs.get("evaluation", "k") is job
+    work = Work("score")
+    retry = jobs.submit("evaluation", "k", work, lane="slow")
+    assert retry is not job
+    finish(retry, work)
+    assert retry.result == "score"
+
+
+def test_new_key_cancels_previous_job(jobs):
+    old, new = Work(), Work()
+    first = jobs.submit("dictionary", "a", old)
+    second = jobs.submit("dictionary", "b", new)
+    assert first.cancelled
+    assert jobs.get("dictionary", "a") is None
+    assert jobs.get("dictionary") is second
+    old.release()
+    finish(second, new)
+
+
+def test_cached_result_finishes_immediately(jobs):
+    job = jobs.submit("translation", "k", Work(), cached="訳")
+    assert job.done() and job.result == "訳"
+    assert jobs.newly_finished() == []
+
+
+def test_cancel_all_clears_slots(jobs):
+    work = Work()
+    job = jobs.submit("transcribe", "k", work)
+    jobs.cancel_all()
+    assert job.cancelled
+    assert jobs.get("transcribe") is None
+    assert jobs.pending() == []
+    work.release()
+
+
+def test_finished_but_unnotified_job_is_reported(jobs):
+    work = Work()
+    job = jobs.submit("evaluation", "k", work, lane="slow")
+    assert not jobs.has_unnotified()
+    # 画面が newly_finished() で確認した後に終わったジョブも、様子見を続ける対象になる
+    assert jobs.newly_finished() == []
+    finish(job, work)
+    assert jobs.pending() == []
+    assert jobs.has_unnotified()
+    assert jobs.newly_finished() == [job]
+    assert not jobs.has_unnotified()
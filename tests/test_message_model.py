@@ -0,0 +1,60 @@
+from message_model import completed_target, parse_response
+
+
+def test_parse_question_with_feedback():
+    message = parse_response("[フィードバック]\n- いいですね！\n- 自然です。\n[英語の質問]\nWhat do you do on **weekends**?")
+    assert message.pattern == "B"
+    assert message.is_question
+    assert message.feedback_lines == ("- いいですね！", "- 自然です。")
+    assert message.target == "What do you do on **weekends**?"
+    assert message.speak_text == "What do you do on weekends?"
+
+
+def test_parse_repeated_question_is_pattern_c():
+    text = "[英語の質問]\nWhere are you from?"
+    assert parse_response(text, previous_question="Where are you from?").pattern == "C"
+    assert parse_response(text, previous_question="How old are you?").pattern == "B"
+
+
+def test_parse_practice_wins_over_question():
+    message = parse_response("［リピート練習］\nI'm going to the park.\n**[英語の質問]**\nAnything else?")
+    assert message.is_practice
+    assert message.target == "I'm going to the park."
+    assert message.speak_text == "I'm going to the park."
+
+
+def test_parse_without_markers_keeps_whole_text_as_feedback():
+    message = parse_response("通信が混み合っています。\nもう一度どうぞ。")
+    assert message.pattern == ""
+    assert message.target == ""
+    assert message.feedback_lines == ("通信が混み合っています。", "もう一度どうぞ。")
+
+
+def test_parse_never_raises_on_empty_input():
+    assert parse_response(None).pattern == ""
+    assert parse_response("").content == ""
+
+
+def test_completed_target_waits_for_end_of_line():
+    assert completed_target("[フィードバック]\n- OK\n[英語の質問]\nWhat are you") == ""
+    assert completed_target("[英語の質問]\nWhat are you doing?\n") == "What are you doing?"
+
+
+def test_completed_target_ends_at_next_marker():
+    assert completed_target("[リピート練習]\nI like it.[フィードバック]") == "I like it."
+
+
+def test_completed_target_ignores_feedback_only():
+    assert completed_target("[フィードバック]\n- いいですね！\n") == ""
+
+
+def test_completed_target_multiline_returns_only_finished_lines():
+    assert completed_target("[英語の質問]\nHi Masa!\nWhat are yo") == "Hi Masa!"
+    assert completed_target("[英語の質問]\nHi Masa!\nWhat are you doing?\n") == "Hi Masa!\nWhat are you doing?"
+    assert completed_target("[英語の質問]\nHi Masa!\nWhat are you doing?[フィードバック]") == "Hi Masa!\nWhat are you doing?"
+
+
+def test_log_text_keeps_text_before_first_marker():
+    message = parse_response("承知しました。\n[フィードバック]\n- いいですね！\n[英語の質問]\nWhere are you from?")
+    assert message.to_log_text() == "承知しました。\n[フィードバック]\n- いいですね！\n[英語の質問]\nWhere are you from?"
+    assert parse_response("[英語の質問]\nWhere are you from?").to_log_text() == "[英語の質問]\nWhere are you from?"
@@ -0,0 +1,46 @@
+import pytest
+
+from pronunciation import is_exact_match, parse_judge_result, word_diff
+
+
+def test_parse_plain_json():
+    result = parse_judge_result('{"transcript": " I like it. ", "match": true, "correction": ""}')
+    assert (result.transcript, result.match, result.correction) == ("I like it.", True, "")
+
+
+def test_parse_json_in_code_block_with_string_match():
+    result = parse_judge_result('```json\n{"transcript": "I like it", "match": "false", "correction": "it が弱いです"}\n```')
+    assert result.transcript == "I like it"
+    assert result.match is False
+    assert result.correction == "it が弱いです"
+
+
+@pytest.mark.parametrize("text", ["123", "null", "true", "[1]", "I like it."])
+def test_parse_non_object_falls_back_to_transcript(text):
+    result = parse_judge_result(text)
+    assert result.transcript == text
+    assert result.match is False
+
+
+def test_parse_empty_reply():
+    assert parse_judge_result(None).transcript == ""
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    assert is_exact_match("i'm going to the **park**", "I'm going to the park.")
+    assert not is_exact_match("I going to the park", "I'm going to the park.")
+
+
+def test_word_diff_marks_missing_and_extra_words():
+    diff = word_diff("I am go to a park", "I am going to the park")
+    assert diff == [
+        ("ok", "I"), ("ok", "am"),
+        ("missing", "going"), ("extra", "go"),
+        ("ok", "to"),
+        ("missing", "the"), ("extra", "a"),
+        ("ok", "park"),
+    ]
+
+
+def test_word_diff_all_ok():
+    assert all(op == "ok" for op, _ in word_diff("See you later!", "see you later"))
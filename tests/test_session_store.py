@@ -0,0 +1,67 @@
+import pytest
+
+from message_model import parse_response, user_message
+from session_store import ConversationLog, SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def fill(log, n):
+    # 発言（偶数番）と返答（奇数番）を交互に。10番ごとに画面に出ない発言を混ぜる
+    for i in range(n):
+        if i % 2:
+            log.append(parse_response(f"[英語の質問]\nQuestion {i}?"))
+        else:
+            log.append(user_message(f"（hidden {i}）" if i % 10 == 0 else f"answer {i}"))
+
+
+def test_recent_visible_reads_older_messages_from_disk(store):
+    log = ConversationLog(store, "c1", keep_recent=4)
+    fill(log, 12)
+    assert len(log) == 12
+    assert log.first_in_memory == 8
+    # 直近4件はメモリ、残りの2件はディスクから。hidden（0番と10番）は飛ばす
+    assert [seq for seq, _ in log.recent_visible(6)] == [5, 6, 7, 8, 9, 11]
+    assert log[2].content == "answer 2"
+
+
+def test_drop_last_refills_memory_from_disk(store):
+    log = ConversationLog(store, "c1", keep_recent=4)
+    fill(log, 12)
+    log.drop_last(2)
+    assert len(log) == 10
+    assert log.first_in_memory == 6
+    assert [log[i].content for i in range(6, 10)] == ["answer 6", "[英語の質問]\nQuestion 7?", "answer 8", "[英語の質問]\nQuestion 9?"]
+    assert store.count("c1") == 10
+
+
+def test_drop_last_more_than_length(store):
+    log = ConversationLog(store, "c1")
+    fill(log, 3)
+    log.drop_last(5)
+    assert len(log) == 0
+    assert log.recent_visible(3) == []
+
+
+def test_reopen_resumes_from_disk(store):
+    fill(ConversationLog(store, "c1", keep_recent=4), 7)
+    log = ConversationLog(store, "c1", keep_recent=4)
+    assert len(log) == 7
+    assert log.last_question() == "Question 5?"
+    assert ConversationLog(store, "other").last_question() == ""
+
+
+def test_two_tabs_on_one_conversation_do_not_overwrite_each_other(store):
+    tab_a = ConversationLog(store, "c1")
+    tab_b = ConversationLog(store, "c1")
+    tab_a.append(user_message("answer from A"))
+    tab_b.append(user_message("answer from B"))
+    tab_a.append(user_message("second from A"))
+    assert store.count("c1") == 3
+    assert [m.content for _, m in store.messages("c1", 0, 3)] == ["answer from A", "answer from B", "second from A"]
+    # 書き込みがぶつかった側は、ディスクの並びに合わせ直している
+    assert len(tab_b) == 2 and tab_b[0].content == "answer from A"
+    assert len(tab_a) == 3 and tab_a[-1].content == "second from A"
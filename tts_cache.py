@@ -0,0 +1,138 @@
+# === 🔊 読み上げ音声（gTTS）のキャッシュ ===
+# 読み上げテキスト＋言語＋速度のハッシュをキーに、MP3をメモリ（LRU）とディスクに保存する。
+# Streamlitは複数セッションを別スレッドで動かすので、操作はすべてロックで守る。
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from gtts import gTTS
+
+
+def tts_cache_key(text, lang="en", slow=False):
+    raw = f"{lang}|{'slow' if slow else 'normal'}|{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def synthesize_mp3(text, lang="en", slow=False):
+    fp = io.BytesIO()
+    gTTS(text=text, lang=lang, slow=slow).write_to_fp(fp)
+    return fp.getvalue()
+
+
+class TTSCache:
+    """読み上げMP3のキャッシュ。メモリはバイト上限つきLRU、ディスクは再起動後も残る。"""
+
+    def __init__(self, cache_dir, max_memory_bytes=32 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "synthesized": 0, "prefetched": 0}
+        # バックグラウンドで生成中の音声（キー → Future）
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _remember(self, key, data):
+        # 呼び出し側でロックを取っていること
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return data
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._remember(key, data)
+            self._stats["disk_hits"] += 1
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+        # 書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            pass
+
+    def _synthesize_and_store(self, key, text, lang, slow, recorder=None):
+        start = time.perf_counter()
+        data = synthesize_mp3(text, lang, slow)
+        if recorder is not None:
+            recorder.record("tts", time.perf_counter() - start, model="gTTS", upload_bytes=len(text.encode("utf-8")))
+        with self._lock:
+            self._stats["synthesized"] += 1
+        self.put(key, data)
+        return data
+
+    def prefetch(self, text, lang="en", slow=False, recorder=None):
+        """返答の表示を待たずに、バックグラウンドで音声の生成を始める。"""
+        key = tts_cache_key(text, lang, slow)
+        with self._lock:
+            if key in self._memory or key in self._pending:
+                return
+            future = self._executor.submit(self._synthesize_and_store, key, text, lang, slow, recorder)
+            self._pending[key] = future
+            self._stats["prefetched"] += 1
+        future.add_done_callback(lambda _: self._forget_pending(key))
+
+    def _forget_pending(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def get_or_synthesize(self, text, lang="en", slow=False, allow_synthesis=True, recorder=None):
+        """キャッシュにあれば返す。なければ allow_synthesis の時だけ gTTS で生成する。"""
+        key = tts_cache_key(text, lang, slow)
+        start = time.perf_counter()
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            # 先読み中ならそれを待つ（同じ音声を二重に生成しない）
+            try:
+                return future.result()
+            except Exception:
+                if not allow_synthesis:
+                    return None
+        data = self.get(key)
+        if data is not None and recorder is not None:
+            recorder.record("tts", time.perf_counter() - start, model="gTTS", cache_hit=True)
+        if data is not None or not allow_synthesis:
+            return data
+        return self._synthesize_and_store(key, text, lang, slow, recorder)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = hits / total if total else 0.0
+        return stats